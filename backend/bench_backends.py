@@ -0,0 +1,87 @@
+# backend/bench_backends.py
+"""Compare the memory and SQLite label backends on synthetic label data.
+
+Each backend is loaded in its own process, so the memory figures are that
+backend's growth in peak RSS (labels plus indexes, or SQLite's page cache).
+
+    python bench_backends.py                 # 100k and 1M videos
+    python bench_backends.py --sizes 10000 --repeat 20
+"""
+import argparse, json, os, resource, subprocess, sys, tempfile, time
+from bench_filters import SITES, QUERIES, synthetic_labels, timed
+
+def rss_mb():
+    """Peak RSS of this process in MB."""
+    # ru_maxrss carries over the parent's peak through fork + exec, VmHWM starts afresh
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:')) / 1024
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def child(backend, json_path, repeat):
+    """Load json_path with backend, run QUERIES and print the results as one JSON line."""
+    from label_store import LabelStoreBuilder
+    from label_index import LabelIndex
+    from json_stream import load_streaming
+    from sqlite_store import SQLiteLabels, build_database
+    from snapshot import snapshot_key
+    from sorting import query_rows
+    base = rss_mb()
+    t0 = time.perf_counter()
+    if backend == 'memory':
+        builder = LabelStoreBuilder()
+        with open(json_path) as f:
+            load_streaming(f, builder.add)
+        store = builder.finish()
+        data = {'store': store, 'index': LabelIndex.build(store)}
+    else:
+        db = json_path + '.sqlite'
+        key = snapshot_key(json_path, None)
+        build_database(json_path, db, key)
+        built = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        labels, _ = SQLiteLabels.open(db, key, lambda other: {})
+        data = {'store': labels, 'sqlite': labels}
+    loaded = time.perf_counter() - t0
+    results = {'build': built if backend == 'sqlite' else loaded, 'open': loaded, 'queries': {}}
+    for name, query in QUERIES.items():
+        seconds, (rows, _) = timed(lambda: query_rows(data, 'bitmap', *query), repeat)
+        # time to first page of labels too, as /api/labels?limit=100 would
+        page, _ = timed(lambda: list(data['store'].items(rows[:100])), repeat)
+        results['queries'][name] = {'matches': len(rows), 'query': seconds, 'page': page}
+    results['rss'] = rss_mb() - base
+    print(json.dumps(results))
+
+def bench(n, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'labels.json')
+        with open(json_path, 'w') as f:
+            json.dump({'sites': {s: {'site': s} for s in SITES}, 'video_labels': synthetic_labels(n)}, f)
+        results = {}
+        for backend in ('memory', 'sqlite'):
+            out = subprocess.run([sys.executable, __file__, '--child', backend, json_path, '--repeat', str(repeat)],
+                                 check=True, capture_output=True, text=True).stdout
+            results[backend] = json.loads(out.splitlines()[-1])
+    mem, sql = results['memory'], results['sqlite']
+    print(f"\n{n:,} videos: memory loaded in {mem['open']:.2f}s using {mem['rss']:.0f} MB; "
+          f"sqlite built in {sql['build']:.2f}s, opened in {sql['open'] * 1000:.1f}ms using {sql['rss']:.0f} MB")
+    print(f"{'query':<12} {'matches':>9} {'memory':>10} {'sqlite':>10} {'page mem':>10} {'page sql':>10}")
+    for name in QUERIES:
+        m, s = mem['queries'][name], sql['queries'][name]
+        if m['matches'] != s['matches']:
+            raise AssertionError(f"sqlite disagrees with memory on {name!r}")
+        print(f"{name:<12} {m['matches']:>9,} {m['query'] * 1000:>8.1f}ms {s['query'] * 1000:>8.1f}ms "
+              f"{m['page'] * 1000:>8.2f}ms {s['page'] * 1000:>8.2f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs per query")
+    parser.add_argument("--child", nargs=2, metavar=("BACKEND", "JSON"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child, args.repeat)
+    else:
+        for n in args.sizes:
+            bench(n, args.repeat)
@@ -0,0 +1,54 @@
+# backend/bench_shards.py
+"""Speedup of sharded query execution (QUERY_SHARDS) by number of worker processes.
+
+    python bench_shards.py                          # 1M videos, 1, 2, 4, ... up to the core count
+    python bench_shards.py --size 200000 --shards 1 2 4 8 --engines scan bitmap
+"""
+import argparse, os, tempfile
+from bench_filters import QUERIES, synthetic_labels, timed
+from label_store import LabelStoreBuilder
+from label_index import LabelIndex
+from snapshot import save_snapshot
+from shards import ShardPool
+from sorting import query_rows
+
+def bench(n, shard_counts, engines, repeat):
+    builder = LabelStoreBuilder()
+    for key, labels in synthetic_labels(n).items():
+        builder.add(key, labels)
+    store = builder.finish()
+    data = {'store': store, 'video_labels': store.view(), 'index': LabelIndex.build(store)}
+    if 'numpy' in engines:
+        from numpy_engine import NumpyIndex
+        data['numpy_index'] = NumpyIndex(store)
+    print(f"\n{n:,} videos on {os.cpu_count()} cores")
+    with tempfile.TemporaryDirectory() as tmp:
+        snap = os.path.join(tmp, 'labels.snapshot')
+        key = {'bench': n}
+        save_snapshot(snap, data, key)
+        for engine in engines:
+            # the scan takes seconds at 1M videos, once is enough to see it
+            runs = 1 if engine == 'scan' else repeat
+            local = {name: timed(lambda: query_rows(data, engine, *query), runs) for name, query in QUERIES.items()}
+            print(f"{engine:<8} {'shards':>6} " + ' '.join(f"{name:>20}" for name in QUERIES))
+            print(f"{'':<8} {'none':>6} " + ' '.join(f"{local[name][0] * 1000:>10.1f}ms {'':>7}" for name in QUERIES))
+            for count in shard_counts:
+                pool = ShardPool.start(snap, key, store, count, engine)
+                cells = []
+                for name, query in QUERIES.items():
+                    seconds, (rows, facets) = timed(lambda: pool.query(engine, *query), runs)
+                    if list(rows) != list(local[name][1][0]) or facets != local[name][1][1]:
+                        raise AssertionError(f"{count} shards disagree with the local {engine} engine on {name!r}")
+                    cells.append(f"{seconds * 1000:>10.1f}ms {local[name][0] / seconds:>6.2f}x")
+                pool.close()
+                print(f"{'':<8} {count:>6} " + ' '.join(cells))
+
+if __name__ == "__main__":
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores])
+    parser.add_argument("--engines", nargs="+", default=["scan", "bitmap"])
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs for the indexed engines")
+    args = parser.parse_args()
+    bench(args.size, args.shards, args.engines, args.repeat)
@@ -0,0 +1,69 @@
+# backend/changelog.py
+import threading
+from collections import deque
+
+def diff_stores(old, new):
+    """(added, removed, modified) key sets between two LabelStores."""
+    old_ids, new_ids = old.key_ids, new.key_ids
+    added = {k for k in new_ids if k not in old_ids}
+    removed = {k for k in old_ids if k not in new_ids}
+    modified = {k for k, i in new_ids.items() if k in old_ids and old.row_key(old_ids[k]) != new.row_key(i)}
+    return added, removed, modified
+
+class ChangeLog:
+    """Added / removed / modified video keys for each of the last few dataset generations."""
+
+    def __init__(self, max_generations=32):
+        self.max_generations = max_generations
+        self._lock = threading.Lock()
+        self._entries = deque()  # (generation, added, removed, modified), oldest first
+        self._base = None  # oldest generation a delta can start from
+        self._head = None  # newest recorded generation
+
+    def reset(self, generation):
+        """Start over at generation: deltas are only available from here on."""
+        with self._lock:
+            self._entries.clear()
+            self._base = self._head = generation
+
+    def record(self, previous, generation, added, removed, modified):
+        """Log the changes that turned generation previous into generation."""
+        with self._lock:
+            if self._head != previous:
+                # a gap in the history, older deltas can no longer be composed
+                self._entries.clear()
+                self._base = previous
+            self._entries.append((generation, set(added), set(removed), set(modified)))
+            self._head = generation
+            while len(self._entries) > self.max_generations:
+                self._base = self._entries.popleft()[0]
+
+    def since(self, generation, until):
+        """Net (added, removed, modified) from generation to until, or None if the log doesn't cover it."""
+        with self._lock:
+            # generations aren't ordered numbers (see dataset.generation_of), go by their place in the log;
+            # content that came back counts from its latest appearance before until
+            order = [self._base] + [e[0] for e in self._entries]
+            if until not in order:
+                return None
+            end = len(order) - 1 - order[::-1].index(until)
+            if generation not in order[:end + 1]:
+                return None
+            start = end - order[end::-1].index(generation)
+            entries = list(self._entries)[start:end]
+        added, removed, modified = set(), set(), set()
+        for _, a, r, m in entries:
+            for k in a:
+                if k in removed:
+                    removed.discard(k)
+                    modified.add(k)
+                else:
+                    added.add(k)
+            for k in r:
+                if k in added:
+                    added.discard(k)
+                else:
+                    modified.discard(k)
+                    removed.add(k)
+            modified |= {k for k in m if k not in added}
+        return added, removed, modified
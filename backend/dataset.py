@@ -0,0 +1,80 @@
+# backend/dataset.py
+import hashlib, threading, time
+from collections.abc import Mapping
+from types import MappingProxyType
+
+GENERATION_HEADER = "X-Dataset-Generation"
+
+def freeze(value):
+    """Read-only copy of a JSON-like value: dicts become mappingproxies, lists tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+class Dataset(Mapping):
+    """One immutable generation of the label data.
+
+    Behaves like the old global data dict ('sites', 'sorted_videos',
+    'video_labels', 'store', 'index', ...) but cannot be modified; changes are
+    made by publishing a new generation. Requests hold on to the generation they
+    started with, so readers never need a lock.
+    """
+
+    def __init__(self, generation, parts, key=None):
+        self.generation = generation
+        self.key = key  # identity of the source JSON (size, mtime, sha256, root)
+        self._parts = MappingProxyType(dict(parts))
+
+    def __getitem__(self, name):
+        return self._parts[name]
+
+    def __iter__(self):
+        return iter(self._parts)
+
+    def __len__(self):
+        return len(self._parts)
+
+    @property
+    def fingerprint(self):
+        return self.key['sha256'] if self.key else ''
+
+_lock = threading.Lock()
+_current = Dataset(0, {})
+
+def current():
+    """The latest published generation."""
+    return _current
+
+def publish(parts, key=None, generation=None):
+    """Freeze parts into a new generation and make it current.
+
+    Plain JSON parts (sites, sorted_videos, ...) are frozen; the store, index and
+    view are immutable by construction. generation, when given, is used as is
+    (see generation_of), so processes loading the same data agree on it.
+    """
+    global _current
+    frozen = {name: freeze(value) for name, value in parts.items()}
+    with _lock:
+        if generation is None or generation == _current.generation:
+            generation = _next_generation(_current.generation)
+        ds = Dataset(generation, frozen, key)
+        _current = ds
+    return ds
+
+def generation_of(key):
+    """Generation number of the data loaded from the source identified by key (see snapshot.snapshot_key).
+
+    Derived from the content hash and path root, not the clock, so the workers of
+    a server that each load the file on their own, or a restarted server, hand
+    out the same generation for the same data. Generations are therefore not
+    ordered; 52 bits keep them exact as JavaScript numbers.
+    """
+    digest = hashlib.sha256(f"{key['sha256']}:{key['root']}".encode()).hexdigest()
+    return int(digest[:13], 16) or 1
+
+def _next_generation(previous):
+    # Millisecond clock for data without a source key, so a client holding
+    # a generation from an earlier process can't mistake it for a current one
+    return max(previous + 1, time.time_ns() // 1_000_000)
@@ -0,0 +1,51 @@
+# backend/filters.py
+from typing import NamedTuple
+from datetime import datetime
+from sorting import parse_dt
+from query_dsl import parse_query, query_text
+
+FILTER_PARAMS = ("sites", "animals", "actions", "add_labels", "start", "end", "restricted", "q")
+
+class Filters(NamedTuple):
+    """Canonical form of the /api/labels filter parameters.
+
+    Multi-valued params are sorted, de-duplicated tuples and dates are parsed,
+    so equivalent queries compare (and hash) equal. query is the parsed q
+    expression (see query_dsl), ANDed with the other filters, or None.
+    """
+    sites: tuple
+    animals: tuple
+    actions: tuple
+    add_labels: tuple
+    start: datetime
+    end: datetime
+    restricted: bool
+    query: tuple = None
+
+    def key(self):
+        """Stable string form, for ETags and cache keys."""
+        return "|".join([
+            ",".join(self.sites), ",".join(self.animals), ",".join(self.actions), ",".join(self.add_labels),
+            self.start.isoformat(), self.end.isoformat(), str(int(self.restricted)),
+            query_text(self.query) if self.query else "",
+        ])
+
+def _values(qp, name):
+    value = qp.get(name)
+    return tuple(sorted(set(value.split(",")))) if value else ()
+
+def parse_filters(qp):
+    """Filters from query params; raises ValueError when a date is missing or malformed, or q doesn't parse."""
+    start, end = qp.get("start"), qp.get("end")
+    if not start or not end:
+        raise ValueError("start and end are required")
+    return Filters(
+        sites=_values(qp, "sites"),
+        animals=_values(qp, "animals"),
+        actions=_values(qp, "actions"),
+        add_labels=_values(qp, "add_labels"),
+        start=parse_dt(start),
+        end=parse_dt(end),
+        restricted=(qp.get("restricted") or "").lower() not in ("", "false", "0"),
+        query=parse_query(qp["q"]) if qp.get("q") else None,
+    )
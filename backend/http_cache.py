@@ -0,0 +1,20 @@
+# backend/http_cache.py
+import hashlib
+from fastapi import Response
+
+def make_etag(ds, *parts):
+    """Strong ETag for a representation of dataset generation ds, varied by parts (filters, encoding, ...)."""
+    digest = hashlib.sha1("\0".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:16]
+    return f'"g{ds.generation}-{ds.fingerprint[:12]}-{digest}"'
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match check (weak comparison, as RFC 9110 asks for this header)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+def not_modified(etag, headers=None):
+    return Response(status_code=304, headers=dict(headers or {}, ETag=etag))
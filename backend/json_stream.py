@@ -0,0 +1,89 @@
+# backend/json_stream.py
+import json
+
+_decoder = json.JSONDecoder()
+_WS = ' \t\n\r'
+
+class _Reader:
+    """Incremental reader over a text file that decodes one JSON value at a time."""
+
+    def __init__(self, f, chunk):
+        self.f = f
+        self.chunk = chunk
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size):
+        if self.pos:
+            # drop what has been consumed so the buffer stays around one chunk
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        block = self.f.read(size)
+        if not block:
+            self.eof = True
+        self.buf += block
+
+    def peek(self):
+        """Next non-whitespace character (without consuming it), '' at end of input."""
+        while True:
+            buf, pos = self.buf, self.pos
+            while pos < len(buf) and buf[pos] in _WS:
+                pos += 1
+            self.pos = pos
+            if pos < len(buf) or self.eof:
+                return buf[pos:pos + 1]
+            self._fill(self.chunk)
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise json.JSONDecodeError(f"Expecting {ch!r}", self.buf, self.pos)
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        size = self.chunk
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # a number ending right at the buffer edge may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(size)
+            size *= 2
+
+    def members(self):
+        """Yield the key of each member of the object at the cursor; the caller decodes its value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+def load_streaming(f, on_member, stream_key='video_labels', chunk=1024 * 1024):
+    """Parse a top-level JSON object from f without materialising f[stream_key].
+
+    Each member of the stream_key object is passed to on_member(key, value) as
+    soon as it is decoded; every other top-level member is returned in a dict.
+    """
+    reader = _Reader(f, chunk)
+    rest = {}
+    for key in reader.members():
+        if key == stream_key and reader.peek() == '{':
+            for member in reader.members():
+                on_member(member, reader.value())
+        else:
+            rest[key] = reader.value()
+    return rest
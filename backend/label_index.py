@@ -0,0 +1,305 @@
+# backend/label_index.py
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple
+
+_ONE = re.compile('1')
+
+def bits_from_positions(positions, n):
+    """Pack a list of row positions into an int bitset (bit i = row i)."""
+    buf = bytearray((n + 7) // 8)
+    for p in positions:
+        buf[p >> 3] |= 1 << (p & 7)
+    return int.from_bytes(buf, 'little')
+
+def range_bits(lo, hi):
+    """Bitset with rows lo..hi-1 set."""
+    return ((1 << hi) - 1) ^ ((1 << lo) - 1) if hi > lo else 0
+
+def bit_positions(bits):
+    """Row positions of the set bits, ascending."""
+    if not bits:
+        return []
+    # bin() is C speed; reversed so string index == bit index
+    return [m.start() for m in _ONE.finditer(bin(bits)[:1:-1])]
+
+class Plan(NamedTuple):
+    """How a query is evaluated: the driver and the predicates in evaluation order, with row estimates."""
+    driver: str   # 'bitmap': AND the predicate bitsets; 'probe': check the driver's rows one by one
+    steps: tuple  # ((predicate, estimated rows), ...)
+
+    def describe(self):
+        return {'driver': self.driver, 'steps': [{'predicate': p, 'estimate': e} for p, e in self.steps]}
+
+class LabelIndex:
+    """Inverted index over video_labels: one int bitset per site / label value.
+
+    Bit i refers to the i-th video in date order, so walking the set bits of a
+    query result yields videos in the same order as data['video_labels'].
+    """
+
+    CATEGORIES = ('animals', 'actions', 'additional_labels')
+    # Checking rows one at a time costs about as much per row as ANDing this many bits
+    # only pays off when the most selective predicate keeps fewer than n / PROBE_RATIO rows
+    PROBE_RATIO = 16384
+
+    def __init__(self, store, sites, values, empty, restricted):
+        self.store = store
+        self.keys = store.keys
+        self.n = len(store)
+        self.all_bits = (1 << self.n) - 1
+        self.sites = sites            # site -> bits
+        self.values = values          # category -> {label: bits}
+        self.empty = empty            # category -> bits of videos with no labels
+        self.restricted = restricted  # bits of videos flagged restricted
+        # popcounts for the planner's estimates
+        self.site_counts = {s: b.bit_count() for s, b in sites.items()}
+        self.value_counts = {c: {v: b.bit_count() for v, b in vals.items()} for c, vals in values.items()}
+        self.empty_counts = {c: b.bit_count() for c, b in empty.items()}
+        self.restricted_count = restricted.bit_count()
+
+    @classmethod
+    def build(cls, store):
+        """Build the bitsets from the id columns of a LabelStore."""
+        n = len(store)
+        nbytes = (n + 7) // 8
+
+        def packed(table, key, i):
+            buf = table.get(key)
+            if buf is None:
+                buf = table[key] = bytearray(nbytes)
+            buf[i >> 3] |= 1 << (i & 7)
+
+        def to_bits(buf):
+            return int.from_bytes(buf, 'little')
+
+        by_site = {}
+        for i, sid in enumerate(store.site_ids):
+            packed(by_site, sid, i)
+        sites = {store.site_vocab[sid]: to_bits(buf) for sid, buf in by_site.items()}
+        for i, extra in store.extras.items():
+            if 'site' in extra:  # unhashable sites can never match a query
+                sites[None] &= ~(1 << i)
+
+        values = {}
+        empty = {}
+        for c in cls.CATEGORIES:
+            offsets, ids = store.label_columns[c]
+            by_label = {}
+            none = bytearray(nbytes)
+            lo = offsets[0]
+            for i in range(n):
+                hi = offsets[i + 1]
+                if lo == hi:
+                    none[i >> 3] |= 1 << (i & 7)
+                else:
+                    for j in ids[lo:hi]:
+                        packed(by_label, j, i)
+                lo = hi
+            values[c] = {store.label_vocab[j]: to_bits(buf) for j, buf in by_label.items()}
+            empty[c] = to_bits(none)
+
+        restricted = [i for i in range(n) if store.is_restricted(i)]
+        return cls(store, sites, values, empty, bits_from_positions(restricted, n))
+
+    def _union(self, table, wanted):
+        bits = 0
+        for w in wanted:
+            bits |= table.get(w, 0)
+        return bits
+
+    def _labels_bits(self, category, wanted):
+        bits = self._union(self.values[category], wanted)
+        # 'none' selects videos without any label in this category
+        if 'none' in wanted:
+            bits |= self.empty[category]
+        return bits
+
+    def value_bits(self, field, value):
+        """Bitset for one site, label ('none' = unlabelled) or restricted 'true'/'false'."""
+        if field == 'restricted':
+            return self.restricted if value == 'true' else self.all_bits & ~self.restricted
+        if field == 'sites':
+            return self.sites.get(value, 0)
+        return self._labels_bits(field, (value,))
+
+    def date_range(self, start, end):
+        """Rows [lo, hi) whose epoch time lies in [start, end]; rows are in time order."""
+        times = self.store.times
+        return bisect_left(times, start), bisect_right(times, end)
+
+    def _estimate(self, predicate, wanted, fraction):
+        # upper bound on the rows, scaled to the date window assuming labels don't depend on time
+        if predicate == 'sites':
+            rows = sum(self.site_counts.get(w, 0) for w in wanted)
+        else:
+            counts = self.value_counts[predicate]
+            rows = sum(counts.get(w, 0) for w in wanted)
+            if 'none' in wanted:
+                rows += self.empty_counts[predicate]
+        return round(min(rows, self.n) * fraction)
+
+    def plan(self, sites, animals, actions, add_labels, restricted, lo=0, hi=None):
+        """Order the predicates by estimated rows and pick bitmap or probe evaluation.
+
+        The date window always comes first in a bitmap plan: rows are in time
+        order, so ANDing with it truncates every later bitset to the window.
+        """
+        hi = self.n if hi is None else hi
+        window = ('date', max(hi - lo, 0))
+        fraction = window[1] / self.n if self.n else 0
+        estimates = [(name, self._estimate(name, wanted, fraction)) for name, wanted in
+                     (('sites', sites), ('animals', animals), ('actions', actions), ('additional_labels', add_labels))]
+        if restricted:
+            estimates.append(('restricted', round((self.n - self.restricted_count) * fraction)))
+        estimates.sort(key=lambda step: step[1])
+        driver = min([window] + estimates, key=lambda step: step[1])
+        if driver[1] * self.PROBE_RATIO < self.n:
+            rest = [window] + estimates
+            rest.remove(driver)
+            return Plan('probe', (driver, *sorted(rest, key=lambda step: step[1])))
+        return Plan('bitmap', (window, *estimates))
+
+    def _predicate_bits(self, predicate, wanted):
+        if predicate == 'restricted':
+            return ~self.restricted
+        if predicate == 'sites':
+            return self._union(self.sites, wanted)
+        return self._labels_bits(predicate, wanted)
+
+    def _row_check(self, predicate, wanted, lo, hi):
+        """Per-row test equivalent to ANDing with the predicate's bitset, for probe plans."""
+        store = self.store
+        if predicate == 'date':
+            return lambda i: lo <= i < hi
+        if predicate == 'restricted':
+            return lambda i: not store.is_restricted(i)
+        if predicate == 'sites':
+            site_ids, extras = store.site_ids, store.extras
+            ids = {j for j, s in enumerate(store.site_vocab) if s in wanted and s in self.sites}
+            return lambda i: site_ids[i] in ids and 'site' not in extras.get(i, ())
+        offsets, label_ids = store.label_columns[predicate]
+        ids = {j for j, v in enumerate(store.label_vocab) if v in wanted}
+        none = 'none' in wanted
+
+        def check(i):
+            a, b = offsets[i], offsets[i + 1]
+            if a == b:
+                return none
+            return any(j in ids for j in label_ids[a:b])
+        return check
+
+    def match(self, sites, animals, actions, add_labels, restricted, lo=0, hi=None, plan=None):
+        """Bitset of videos in rows [lo, hi) passing the site / label / restricted filters."""
+        hi = self.n if hi is None else hi
+        plan = plan or self.plan(sites, animals, actions, add_labels, restricted, lo, hi)
+        wanted = {'sites': sites, 'animals': animals, 'actions': actions, 'additional_labels': add_labels, 'restricted': None}
+        window = range_bits(lo, hi)
+        if plan.driver == 'probe':
+            (driver, _), rest = plan.steps[0], plan.steps[1:]
+            if driver == 'date':
+                rows = range(lo, hi)
+            else:
+                # shifted down to the window, so bin() only formats hi - lo digits
+                driver_bits = (self._predicate_bits(driver, wanted[driver]) & window) >> lo
+                rows = [lo + i for i in bit_positions(driver_bits)]
+            for predicate, _ in rest:
+                check = self._row_check(predicate, wanted.get(predicate), lo, hi)
+                rows = [i for i in rows if check(i)]
+            return bits_from_positions(rows, self.n)
+        bits = window
+        for predicate, _ in plan.steps[1:]:
+            if not bits:
+                break
+            bits &= self._predicate_bits(predicate, wanted[predicate])
+        return bits
+
+    def preview(self, sites, animals, actions, add_labels, restricted, lo=0, hi=None, within=None):
+        """Match count now, and the count after toggling each single site / label / restricted.
+
+        Each category's predicate is intersected with the other categories once;
+        a toggle then costs one union and one AND + popcount instead of a rescan.
+        """
+        window = range_bits(lo, self.n if hi is None else hi)
+        if within is not None:  # e.g. a q expression, held fixed while toggling
+            window &= within
+        unrestricted = window & ~self.restricted
+        selected = {'sites': set(sites), 'animals': set(animals), 'actions': set(actions), 'add_labels': set(add_labels)}
+        tables = {'sites': None, 'animals': 'animals', 'actions': 'actions', 'add_labels': 'additional_labels'}
+
+        def predicate(name, wanted):
+            # an empty selection matches nothing, like the early exit in resort_all_data
+            if not wanted:
+                return 0
+            if tables[name] is None:
+                return self._union(self.sites, wanted)
+            return self._labels_bits(tables[name], wanted)
+
+        predicates = {name: predicate(name, wanted) for name, wanted in selected.items()}
+
+        def combine(bits, skip=None):
+            for name, p in predicates.items():
+                if name != skip:
+                    bits &= p
+            return bits
+
+        base = unrestricted if restricted else window
+        toggles = {}
+        for name, wanted in selected.items():
+            rest = combine(base, skip=name)
+            if tables[name] is None:
+                candidates = [s for s in self.sites if s]
+            else:
+                candidates = ['none'] + [v for v in self.values[tables[name]] if v != 'none']
+            toggles[name] = {v: (rest & predicate(name, wanted ^ {v})).bit_count() if rest else 0 for v in candidates}
+        return {
+            'count': combine(base).bit_count(),
+            'toggles': toggles,
+            'restricted': combine(window if restricted else unrestricted).bit_count(),
+        }
+
+    def facets(self, bits):
+        """Per-value video counts within bits, in the shape of reverse_subset.
+
+        'none' counts videos with no labels in a category (plus any explicit
+        'none' label); values with no matching video are left out. Each count is
+        one AND + popcount, so the cost follows the vocabulary, not the result.
+        """
+        facets = {'sites': {}}
+        for site, site_bits in self.sites.items():
+            count = (bits & site_bits).bit_count()
+            if count and site:
+                facets['sites'][site] = count
+        for c, name in zip(self.CATEGORIES, ('animals', 'actions', 'add_labels')):
+            counts = facets[name] = {}
+            none = self.empty[c] | self.values[c].get('none', 0)
+            count = (bits & none).bit_count()
+            if count:
+                counts['none'] = count
+            for value, value_bits in self.values[c].items():
+                if value != 'none':
+                    count = (bits & value_bits).bit_count()
+                    if count:
+                        counts[value] = count
+        return facets
+
+    def cut(self, sub, lo, hi):
+        """Index of rows [lo, hi) alone, for sub = store.slice(lo, hi); bit j is row lo + j."""
+        mask = range_bits(0, hi - lo)
+        local = lambda bits: (bits >> lo) & mask
+        return LabelIndex(
+            sub,
+            {s: b for s, b in ((s, local(b)) for s, b in self.sites.items()) if b},
+            {c: {v: b for v, b in ((v, local(b)) for v, b in vals.items()) if b} for c, vals in self.values.items()},
+            {c: local(b) for c, b in self.empty.items()},
+            local(self.restricted),
+        )
+
+    def rows_of(self, bits):
+        """Row ids of the set bits as a compact array, in date order."""
+        return array('I', bit_positions(bits))
+
+    def keys_of(self, bits):
+        keys = self.keys
+        return [keys[i] for i in bit_positions(bits)]
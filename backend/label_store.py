@@ -0,0 +1,385 @@
+# backend/label_store.py
+import sys, calendar, zlib
+from array import array
+from functools import cached_property
+from collections.abc import Mapping, Sequence
+from datetime import datetime
+from sorting import to_epoch, from_epoch
+
+CATEGORIES = ('animals', 'actions', 'additional_labels')
+
+# Per-row flag bits: which standard fields are present and backed by a column
+F_SITE = 1
+F_ANIMALS = 2
+F_ACTIONS = 4
+F_ADD_LABELS = 8
+F_RESTRICTED = 16
+F_RESTRICTED_TRUE = 32
+LABEL_FLAGS = {'animals': F_ANIMALS, 'actions': F_ACTIONS, 'additional_labels': F_ADD_LABELS}
+
+# How a row's time is rebuilt from the epoch column; anything else is kept verbatim
+TIME_ISO = 0       # "%Y-%m-%dT%H:%M:%S"
+TIME_DATE = 1      # "%Y-%m-%d"
+TIME_VERBATIM = 2
+
+def parse_time(value):
+    """(epoch seconds, time format code) for a video's time value."""
+    if isinstance(value, str):
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            dt = None
+        # only canonical strings take the fast path, so they rebuild byte for byte
+        if dt is not None and dt.tzinfo is None:
+            if 'T' in value and dt.isoformat() == value:
+                return calendar.timegm(dt.timetuple()), TIME_ISO
+            if 'T' not in value and dt.date().isoformat() == value:
+                return calendar.timegm(dt.timetuple()), TIME_DATE
+    return to_epoch(value), TIME_VERBATIM
+
+class Interner:
+    """Maps values to small integer ids, in first-seen order."""
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.ids = {v: i for i, v in enumerate(self.values)}
+
+    def __call__(self, value):
+        i = self.ids.get(value)
+        if i is None:
+            i = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+class LabelStoreBuilder:
+    """Accumulates videos row by row into the column arrays of a LabelStore.
+
+    Rows are added in file order and sorted once by time in finish(), so a
+    loader can feed it straight from a JSON stream without holding the dicts.
+    """
+
+    SAMPLE_EVERY = 64  # rows between dict-size samples for the memory report
+
+    def __init__(self, site_vocab=None, label_vocab=None):
+        self.keys = []
+        self.key_rows = {}
+        self.replaced = set()
+        self.dict_bytes_sampled = 0
+        self.sites = site_vocab or Interner()
+        self.labels = label_vocab or Interner()
+        self.site_ids = array('I')
+        self.times = array('q')
+        self.time_fmt = array('B')
+        self.flags = array('B')
+        self.offsets = {c: array('I', [0]) for c in CATEGORIES}
+        self.label_ids = {c: array('I') for c in CATEGORIES}
+        self.extras = {}
+
+    def add(self, key, labels):
+        row = len(self.keys)
+        if row % self.SAMPLE_EVERY == 0:
+            self.dict_bytes_sampled += dict_nbytes(key) + dict_nbytes(labels)
+        # a repeated key replaces the earlier row, like a dict assignment would
+        previous = self.key_rows.get(key)
+        if previous is not None:
+            self.replaced.add(previous)
+        self.key_rows[key] = row
+        flags = 0
+        extra = {}
+        for field, value in labels.items():
+            if field in ('site', 'time') or field in LABEL_FLAGS or field == 'restricted':
+                continue
+            extra[field] = value
+
+        site = labels.get('site')
+        try:
+            self.site_ids.append(self.sites(site))
+            if 'site' in labels:
+                flags |= F_SITE
+        except TypeError:  # unhashable site, keep it verbatim
+            self.site_ids.append(self.sites(None))
+            extra['site'] = site
+
+        for c in CATEGORIES:
+            ids = self.label_ids[c]
+            if c in labels:
+                vals = labels[c]
+                if isinstance(vals, list):
+                    ids.extend(self.labels(v) for v in vals)
+                    flags |= LABEL_FLAGS[c]
+                else:  # malformed, keep it verbatim and index it as unlabelled
+                    extra[c] = vals
+            self.offsets[c].append(len(ids))
+
+        if 'restricted' in labels:
+            r = labels['restricted']
+            if isinstance(r, bool):
+                flags |= F_RESTRICTED | (F_RESTRICTED_TRUE if r else 0)
+            else:
+                extra['restricted'] = r
+
+        t = labels['time']
+        epoch, fmt = parse_time(t)
+        if fmt == TIME_VERBATIM:
+            extra['time'] = t
+        self.times.append(epoch)
+        self.time_fmt.append(fmt)
+
+        self.keys.append(key)
+        self.flags.append(flags)
+        if extra:
+            self.extras[row] = extra
+
+    def estimated_dict_nbytes(self):
+        """Size the rows would have taken as a dict-of-dicts, extrapolated from the samples."""
+        return self.dict_bytes_sampled * self.SAMPLE_EVERY
+
+    def finish(self, elevations=None):
+        """Sort the rows by their epoch time (stable) and hand the columns to a LabelStore."""
+        times = self.times
+        order = sorted(range(len(times)), key=times.__getitem__)
+        if self.replaced:
+            order = [i for i in order if i not in self.replaced]
+        if len(order) != len(times) or any(order[i] != i for i in range(len(order))):
+            self._permute(order)
+        self.key_rows = None
+        return LabelStore(
+            self.keys, self.sites.values, self.site_ids, self.labels.values,
+            {c: (self.offsets[c], self.label_ids[c]) for c in CATEGORIES},
+            self.times, self.time_fmt, self.flags, self.extras, elevations or {},
+        )
+
+    def _permute(self, order):
+        self.keys = [self.keys[i] for i in order]
+        for name in ('site_ids', 'times', 'time_fmt', 'flags'):
+            col = getattr(self, name)
+            setattr(self, name, array(col.typecode, [col[i] for i in order]))
+        for c in CATEGORIES:
+            offsets, ids = self.offsets[c], self.label_ids[c]
+            new_offsets, new_ids = array('I', [0]), array('I')
+            for i in order:
+                new_ids.extend(ids[offsets[i]:offsets[i + 1]])
+                new_offsets.append(len(new_ids))
+            self.offsets[c], self.label_ids[c] = new_offsets, new_ids
+        new_row = array('q', [-1]) * (max(order, default=-1) + 1)
+        for new, old in enumerate(order):
+            new_row[old] = new
+        self.extras = {new_row[old]: extra for old, extra in self.extras.items()
+                       if old < len(new_row) and new_row[old] >= 0}
+
+class LabelStore:
+    """Columnar, interned storage for video_labels.
+
+    Videos are addressed by integer id (their position in date order). Sites and
+    labels are stored as ids into shared vocabularies, multi-valued labels as
+    CSR offset/id arrays, and times as a sorted column of epoch seconds.
+    """
+
+    def __init__(self, keys, site_vocab, site_ids, label_vocab, label_columns,
+                 times, time_fmt, flags, extras, elevations):
+        self.keys = keys
+        self.site_vocab = site_vocab
+        self.site_ids = site_ids
+        self.label_vocab = label_vocab
+        self.label_columns = label_columns
+        self.times = times
+        self.time_fmt = time_fmt
+        self.flags = flags
+        self.extras = extras
+        self.elevations = elevations
+
+    @cached_property
+    def key_ids(self):
+        return {k: i for i, k in enumerate(self.keys)}
+
+    @classmethod
+    def from_video_labels(cls, video_labels, elevations=None):
+        builder = LabelStoreBuilder()
+        for key, labels in video_labels.items():
+            builder.add(key, labels)
+        return builder.finish(elevations)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def slice(self, lo, hi):
+        """Rows [lo, hi) as a LabelStore sharing this one's columns and vocabularies (row lo becomes 0)."""
+        col = lambda a, end: memoryview(a)[lo:end]
+        return LabelStore(
+            self.keys[lo:hi], self.site_vocab, col(self.site_ids, hi), self.label_vocab,
+            # offsets stay absolute into the shared id arrays
+            {c: (col(offsets, hi + 1), ids) for c, (offsets, ids) in self.label_columns.items()},
+            col(self.times, hi), col(self.time_fmt, hi), col(self.flags, hi),
+            {i - lo: e for i, e in self.extras.items() if lo <= i < hi}, self.elevations,
+        )
+
+    def labels(self, category, i):
+        offsets, ids = self.label_columns[category]
+        vocab = self.label_vocab
+        return [vocab[j] for j in ids[offsets[i]:offsets[i + 1]]]
+
+    def is_restricted(self, i):
+        extra = self.extras.get(i)
+        if extra and 'restricted' in extra:
+            return bool(extra['restricted'])
+        return bool(self.flags[i] & F_RESTRICTED_TRUE)
+
+    def row_key(self, i):
+        """Cheap comparable form of row i, for spotting changed videos between two stores."""
+        return (
+            self.site_vocab[self.site_ids[i]], self.times[i], self.time_fmt[i], self.flags[i],
+            tuple(tuple(self.labels(c, i)) for c in CATEGORIES), self.extras.get(i),
+        )
+
+    def row(self, i):
+        """Rebuild the label dict for video i (a fresh dict on every call)."""
+        flags = self.flags[i]
+        labels = {}
+        if flags & F_SITE:
+            labels['site'] = self.site_vocab[self.site_ids[i]]
+        for c in CATEGORIES:
+            if flags & LABEL_FLAGS[c]:
+                labels[c] = self.labels(c, i)
+        fmt = self.time_fmt[i]
+        if fmt == TIME_ISO:
+            labels['time'] = from_epoch(self.times[i]).isoformat()
+        elif fmt == TIME_DATE:
+            labels['time'] = from_epoch(self.times[i]).date().isoformat()
+        if flags & F_RESTRICTED:
+            labels['restricted'] = bool(flags & F_RESTRICTED_TRUE)
+        extra = self.extras.get(i)
+        if extra:
+            labels.update(extra)
+        site = labels.get('site')
+        if site in self.elevations:
+            labels['elevation'] = self.elevations[site]
+        return labels
+
+    def items(self, rows):
+        """(path, label dict) for each row id in rows, in that order."""
+        keys = self.keys
+        return ((keys[i], self.row(i)) for i in rows)
+
+    def view(self):
+        return VideoLabelsView(self)
+
+    def nbytes(self):
+        """Approximate memory held by the store."""
+        size = sys.getsizeof(self.keys) + sys.getsizeof(self.key_ids)
+        size += sum(sys.getsizeof(k) for k in self.keys)
+        size += sum(sys.getsizeof(v) for v in self.site_vocab) + sum(sys.getsizeof(v) for v in self.label_vocab)
+        for a in (self.site_ids, self.times, self.time_fmt, self.flags):
+            size += a.itemsize * len(a)
+        for offsets, ids in self.label_columns.values():
+            size += offsets.itemsize * len(offsets) + ids.itemsize * len(ids)
+        size += sys.getsizeof(self.extras) + sum(dict_nbytes(e) for e in self.extras.values())
+        return size
+
+class VideoLabelsView(Mapping):
+    """Read-only dict-like view of a LabelStore: path -> label dict."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, key):
+        return self.store.row(self.store.key_ids[key])
+
+    def __contains__(self, key):
+        return key in self.store.key_ids
+
+    def __iter__(self):
+        return iter(self.store.keys)
+
+    def __len__(self):
+        return len(self.store.keys)
+
+def _key_hash(data):
+    # stable across processes, unlike hash()
+    return zlib.crc32(data)
+
+class MappedKeys(Sequence):
+    """Video keys decoded on access from a '\\0'-joined UTF-8 blob, e.g. in a snapshot mapping.
+
+    offsets[i]:offsets[i + 1] - 1 are key i's bytes, so nothing is held per
+    key and processes mapping the same file share it. Slices are views.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def encoded(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            lo, hi, step = i.indices(len(self))
+            if step != 1:
+                return [self[j] for j in range(lo, hi, step)]
+            return MappedKeys(self.blob, self.offsets[lo:max(lo, hi) + 1])
+        if i < 0:
+            i += len(self)
+        return str(self.encoded(i), 'utf-8', 'surrogatepass')
+
+    def __iter__(self):
+        blob, offsets = self.blob, self.offsets
+        for i in range(len(self)):
+            yield str(blob[offsets[i]:offsets[i + 1] - 1], 'utf-8', 'surrogatepass')
+
+class MappedKeyIds(Mapping):
+    """key -> row lookups for MappedKeys through an open addressing hash table (row + 1 per slot, 0 empty)."""
+
+    def __init__(self, keys, table):
+        self.keys = keys
+        self.table = table
+        self.mask = len(table) - 1
+
+    @staticmethod
+    def build_table(keys):
+        """The hash table for keys (distinct strings), twice as many slots as keys or more."""
+        table = array('I', bytes(4 << max(1, (2 * len(keys) - 1).bit_length())))
+        mask = len(table) - 1
+        for i, key in enumerate(keys):
+            slot = _key_hash(key.encode('utf-8', 'surrogatepass')) & mask
+            while table[slot]:
+                slot = (slot + 1) & mask
+            table[slot] = i + 1
+        return table
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            raise KeyError(key)
+        data = key.encode('utf-8', 'surrogatepass')
+        table, mask, keys = self.table, self.mask, self.keys
+        slot = _key_hash(data) & mask
+        while table[slot]:
+            row = table[slot] - 1
+            if keys.encoded(row) == data:
+                return row
+            slot = (slot + 1) & mask
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+def dict_nbytes(obj, seen=None):
+    """Rough deep size of a JSON-like object (dicts, lists, scalars), shared objects counted once."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += dict_nbytes(k, seen) + dict_nbytes(v, seen)
+    elif isinstance(obj, list):
+        for v in obj:
+            size += dict_nbytes(v, seen)
+    return size
@@ -0,0 +1,87 @@
+# backend/loading.py
+import threading, time
+
+# Share of the overall percentage each phase of a load accounts for. A load
+# skips the phases it doesn't need, e.g. a valid snapshot replaces reading and indexing.
+PHASES = {
+    'hashing': (0, 10),      # fingerprinting the label JSON
+    'reading': (10, 60),     # streaming it into the label store
+    'indexing': (60, 80),
+    'snapshot': (80, 90),    # writing the snapshot, or mapping one instead of reading and indexing
+    'database': (10, 90),    # building or opening the SQLite database
+    'shards': (90, 93),
+    'publishing': (93, 95),
+    'payload': (95, 100),    # the initial /api/labels payload
+}
+
+class LoadCancelled(Exception):
+    """Raised in the loading thread at its next progress report once the server is shutting down."""
+
+class LoadProgress:
+    """Phase and percent done of the running (or last) dataset load, reported by the loading thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self.phase = 'starting'
+        self.percent = 0.0
+        self.started = time.monotonic()
+        self.finished = None
+        self.error = None
+
+    def start(self):
+        with self._lock:
+            self.phase, self.percent, self.error = 'starting', 0.0, None
+            self.started, self.finished = time.monotonic(), None
+
+    def enter(self, phase, fraction=0.0):
+        """Move on to phase, fraction of the way through it."""
+        if self._cancelled:
+            raise LoadCancelled()
+        lo, hi = PHASES[phase]
+        with self._lock:
+            self.phase = phase
+            self.percent = max(self.percent, lo + (hi - lo) * fraction)
+
+    def advance(self, fraction):
+        """Report fraction of the current phase done."""
+        self.enter(self.phase, fraction)
+
+    def done(self):
+        with self._lock:
+            self.phase, self.percent, self.finished = 'ready', 100.0, time.monotonic()
+
+    def failed(self, error):
+        with self._lock:
+            self.phase, self.error, self.finished = 'failed', repr(error), time.monotonic()
+
+    def cancel(self):
+        """Make the loading thread stop at its next progress report."""
+        self._cancelled = True
+
+    def status(self):
+        """JSON-able view for the readiness endpoint."""
+        with self._lock:
+            elapsed = (self.finished or time.monotonic()) - self.started
+            return {'phase': self.phase, 'percent': round(self.percent, 1), 'elapsed': round(elapsed, 1), 'error': self.error}
+
+    def retry_after(self):
+        """Seconds until the load is likely done, extrapolated from its progress so far, between 1 and 60."""
+        status = self.status()
+        if status['phase'] == 'failed' or status['percent'] <= 0:
+            return 5
+        remaining = status['elapsed'] * (100 - status['percent']) / status['percent']
+        return max(1, min(60, round(remaining)))
+
+class ProgressFile:
+    """Read-only file wrapper that reports how much of the file has been read, as a fraction of its size."""
+
+    def __init__(self, f, size, report):
+        self.f = f
+        self.size = size or 1
+        self.report = report
+
+    def read(self, size=-1):
+        block = self.f.read(size)
+        self.report(min(1.0, self.f.buffer.tell() / self.size))
+        return block
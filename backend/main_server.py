@@ -1,11 +1,30 @@
 # backend/app.py
-import os, json, mimetypes
+import os, mimetypes, time, asyncio, traceback
 from datetime import datetime, timedelta
 from fastapi import FastAPI, Request, HTTPException, Response, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sorting import resort_all_data, reverse_subset, convert_video_labels, sort_video_labels_by_date
+from starlette.concurrency import run_in_threadpool
+from watchfiles import awatch
+from sorting import query_rows, explain_query, preview_all_data, convert_path, FILTER_ENGINES
+from numpy_engine import NumpyIndex
+from label_store import LabelStoreBuilder, Interner
+from partitions import PartitionedIndex
+from json_stream import load_streaming
+from snapshot import snapshot_path, snapshot_key, snapshot_matches, load_snapshot, save_snapshot
+import dataset
+from dataset import GENERATION_HEADER
+from payloads import PayloadCache, encode_labels_payload, labels_json, compact_labels_json, ndjson_lines, choose_encoding, ENCODINGS
+from filters import parse_filters, FILTER_PARAMS
+from http_cache import make_etag, etag_matches, not_modified
+from query_cache import QueryCache
+from pagination import parse_page, page_rows
+from changelog import ChangeLog, diff_stores
+from shards import ShardPool
+from loading import LoadProgress, LoadCancelled, ProgressFile
+import shared_dataset
+from sqlite_store import SQLiteLabels, database_path, build_database, remove_stale_databases
 from pathlib import Path
 import platform
 from dotenv import load_dotenv
@@ -17,6 +36,27 @@ load_dotenv()
 
 DEFAULT_JSON_BASENAME = "GameCamClassifiers.json"
 APP_PORT = 10000
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+# Memory the cached query results may hold in total, in MB
+QUERY_CACHE_MB = float(os.getenv("QUERY_CACHE_MB", "64"))
+DELTA_GENERATIONS = int(os.getenv("DELTA_GENERATIONS", "32"))
+# How long before midnight the next day's initial payloads are built (their "end" is the current date)
+PAYLOAD_PREWARM_SECONDS = int(os.getenv("PAYLOAD_PREWARM_SECONDS", "600"))
+FILTER_ENGINE = os.getenv("FILTER_ENGINE", "bitmap").lower()  # bitmap, numpy or scan
+if FILTER_ENGINE not in FILTER_ENGINES:
+    raise ValueError(f"FILTER_ENGINE must be one of {', '.join(FILTER_ENGINES)}, got {FILTER_ENGINE!r}")
+# Worker processes that each filter a slice of the dataset in parallel, 0 to filter in the server process
+QUERY_SHARDS = int(os.getenv("QUERY_SHARDS", "0"))
+# Filter engines whose queries go to the shard workers; bitmap and numpy are faster in process (see bench_shards.py)
+QUERY_SHARD_ENGINES = {e.strip() for e in os.getenv("QUERY_SHARD_ENGINES", "scan").lower().split(",") if e.strip()}
+# Reload when the label file changes, 0 to load it only at startup
+WATCH_LABEL_FILE = os.getenv("WATCH_LABEL_FILE", "1").lower() not in ("", "0", "false")
+# One loader builds the dataset into a file every uvicorn worker maps, instead of a private copy each
+SHARED_DATASET = os.getenv("SHARED_DATASET", "").lower() not in ("", "0", "false")
+# Where the labels from JSON_DIR are served from: memory (label store + indexes) or sqlite (a database next to the JSON)
+LABEL_BACKEND = os.getenv("LABEL_BACKEND", "memory").lower()
+if LABEL_BACKEND not in ("memory", "sqlite"):
+    raise ValueError(f"LABEL_BACKEND must be memory or sqlite, got {LABEL_BACKEND!r}")
 
 # Security configuration
 SECRET_KEY = "pecoscams-family-secret-key-2024"
@@ -32,7 +72,6 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 system = platform.system().lower()
 default_restricted = True
-data = {}
 
 # Hash the password on startup
 PASSWORD_HASH = pwd_context.hash(PASSWORD)
@@ -50,6 +89,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def get_dataset(response: Response):
+    """The current dataset generation, pinned for the whole request and reported in a response header.
+    Until the first load has finished there is none, and the request gets a 503 to retry later."""
+    ds = dataset.current()
+    if ds.generation == 0:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Label data is still loading",
+                            headers={"Retry-After": str(load_progress.retry_after())})
+    response.headers[GENERATION_HEADER] = str(ds.generation)
+    return ds
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -80,31 +129,305 @@ def get_json_path():
     path = os.path.join(p, DEFAULT_JSON_BASENAME)
     return path, p
 
+def site_elevations(data):
+    return {v['site']: v['elevation'] for v in data['sites'].values()}
+
+def build_dataset(path, root, previous=None):
+    """Streams the JSON into the label store (converting paths as needed) and builds the index.
+    Only the monthly partitions that changed since the previous dataset are indexed again."""
+    if previous is not None and 'store' in previous:
+        # same ids for the same sites and labels, so unchanged partitions hash the same
+        old = previous['store']
+        builder = LabelStoreBuilder(Interner(old.site_vocab), Interner(old.label_vocab))
+    else:
+        builder = LabelStoreBuilder()
+    if system == 'linux':
+        add_video = lambda video, labels: builder.add(convert_path(video, root), labels)
+    else:
+        add_video = builder.add
+
+    # video_labels is parsed one entry at a time; only the rest of the file is kept as dicts
+    load_progress.enter('reading')
+    with open(path, 'r') as f:
+        data = load_streaming(ProgressFile(f, os.fstat(f.fileno()).st_size, load_progress.advance), add_video)
+
+    store = builder.finish(site_elevations(data))
+    data['video_labels'] = store.view()
+    data['store'] = store
+    load_progress.enter('indexing')
+    partitions, rebuilt = PartitionedIndex.build(store, previous.get('partitions') if previous is not None else None)
+    data['partitions'] = partitions
+    data['index'] = partitions.merged()
+    print(f"Indexed {rebuilt} of {len(partitions.partitions)} monthly partitions.")
+    dict_size = builder.estimated_dict_nbytes()
+    store_size = store.nbytes()
+    print(f"Label store: {store_size / 1e6:.1f} MB vs ~{dict_size / 1e6:.1f} MB as dicts "
+          f"(~{(dict_size - store_size) / 1e6:.1f} MB saved) for {len(store)} videos.")
+    return data
+
+def load_sqlite_dataset(path, root, key, previous):
+    """Opens the SQLite database built from this version of the JSON, building it first when missing or stale."""
+    db = database_path(path, key)
+    load_progress.enter('database')
+    opened = SQLiteLabels.open(db, key, site_elevations)
+    if opened is None:
+        t0 = time.perf_counter()
+        build_database(path, db, key, (lambda video: convert_path(video, root)) if system == 'linux' else None)
+        print(f"Built SQLite database {db} in {time.perf_counter() - t0:.2f}s.")
+        opened = SQLiteLabels.open(db, key, site_elevations)
+    labels, data = opened
+    data['video_labels'] = labels.view()
+    data['store'] = data['sqlite'] = labels
+    # requests still running on the previous generation may be reading its database
+    keep = {db}
+    if 'sqlite' in previous:
+        keep.add(previous['sqlite'].path)
+    remove_stale_databases(path, keep)
+    return data
+
+def load_shared_dataset(path, root, key, previous):
+    """Maps the dataset segment for this version of the JSON, building it when this worker is the first to need it."""
+    def build():
+        data = build_dataset(path, root, previous)
+        # what every worker needs to agree on: the changes since the last generation
+        info = {}
+        if 'store' in previous:
+            added, removed, modified = diff_stores(previous['store'], data['store'])
+            info.update(previous=previous.generation, added=sorted(added), removed=sorted(removed), modified=sorted(modified))
+        return data, info
+    loaded, built = shared_dataset.attach(path, key, build, site_elevations)
+    loaded['partitions'], _ = PartitionedIndex.build(loaded['store'], previous.get('partitions'), loaded['index'])
+    return loaded, built
+
 def load_data_into_memory():
-    """Reads and processes the JSON data, storing it in the global data_store. Also converts paths as needed"""
+    """Loads the processed dataset, from the snapshot next to the JSON when it is still valid, and publishes it as a new generation.
+    The new dataset is built on the side and swapped in with a single assignment, so requests never see a partial one."""
     print("Loading and sorting label data from disk...")
-    global data
+    load_progress.start()
     path, root = get_json_path()
     print(f"Using JSON path: {path}")
-    with open(path, 'r') as f:
-        init_data = json.load(f)
-
-    if system == 'linux':
-        converted_data = convert_video_labels(init_data, root)
+    t0 = time.perf_counter()
+    previous = dataset.current()
+    load_progress.enter('hashing')
+    key = snapshot_key(path, root if system == 'linux' else None)
+    if previous.key and (previous.key['sha256'], previous.key['root']) == (key['sha256'], key['root']):
+        # touched or rewritten with the same content: keep the generation, so cached results, ETags and cursors stay valid
+        load_progress.done()
+        print(f"Label file content unchanged, keeping generation {previous.generation}.")
+        return
+    snap = snapshot_path(path)
+    loaded = load_snapshot(snap, key, site_elevations) if LABEL_BACKEND == "memory" and not SHARED_DATASET else None
+    if LABEL_BACKEND == "memory" and SHARED_DATASET:
+        loaded, built = load_shared_dataset(path, root, key, previous)
+        snap = loaded['segment'].path
+        print(f"{'Built' if built else 'Attached to'} shared dataset segment {snap} in {time.perf_counter() - t0:.2f}s.")
+    elif LABEL_BACKEND == "sqlite":
+        loaded = load_sqlite_dataset(path, root, key, previous)
+        print(f"Opened SQLite label backend in {time.perf_counter() - t0:.2f}s.")
+    elif loaded is not None:
+        loaded['partitions'], _ = PartitionedIndex.build(loaded['store'], previous.get('partitions'), loaded['index'])
+        print(f"Loaded snapshot {snap} in {time.perf_counter() - t0:.2f}s.")
     else:
-        converted_data = init_data
+        loaded = build_dataset(path, root, previous)
+        print(f"Built dataset from JSON in {time.perf_counter() - t0:.2f}s.")
+        t1 = time.perf_counter()
+        load_progress.enter('snapshot')
+        try:
+            # the other workers of a multi-worker server build the same dataset at the same time
+            if snapshot_matches(snap, key):
+                print(f"Snapshot {snap} was already written by another process.")
+            else:
+                save_snapshot(snap, loaded, key)
+                print(f"Wrote snapshot {snap} in {time.perf_counter() - t1:.2f}s.")
+        except OSError as e:
+            print(f"Could not write snapshot {snap}: {e}")
+            snap = None
+    if QUERY_SHARDS and LABEL_BACKEND == "memory" and FILTER_ENGINE not in QUERY_SHARD_ENGINES:
+        print(f"QUERY_SHARDS is ignored: FILTER_ENGINE={FILTER_ENGINE} filters faster in process than in the shard workers "
+              f"(add it to QUERY_SHARD_ENGINES to shard it anyway).")
+    elif QUERY_SHARDS and LABEL_BACKEND == "memory" and snap is None:
+        print("No snapshot for the query shard workers to map, QUERY_SHARDS is ignored and queries are filtered in process.")
+    elif QUERY_SHARDS and LABEL_BACKEND == "memory":
+        # the workers map the snapshot just written or loaded
+        t1 = time.perf_counter()
+        load_progress.enter('shards')
+        loaded['shards'] = ShardPool.start(snap, key, loaded['store'], QUERY_SHARDS, FILTER_ENGINE)
+        if loaded['shards'] is not None:
+            print(f"Started {len(loaded['shards'].workers)} query shard workers in {time.perf_counter() - t1:.2f}s.")
+    if FILTER_ENGINE == "numpy" and LABEL_BACKEND == "memory":
+        # views over the store columns, rebuilt on every load rather than snapshotted
+        loaded['numpy_index'] = NumpyIndex(loaded['store'])
+    load_progress.enter('publishing')
+    info = loaded.get('snapshot_info') or {}
+    ds = dataset.publish(loaded, key, dataset.generation_of(key))
+    if previous.get('segment') is not None:
+        # the last worker to move on deletes the old segment
+        previous['segment'].release()
+        shared_dataset.retire(path, ds['segment'].path)
+    if previous.get('shards') is not None:
+        # requests still on the previous generation fall back to filtering in process
+        previous['shards'].close()
+    if 'added' in info:
+        # diffed once by the worker that built the segment
+        change_log.record(info['previous'], ds.generation, set(info['added']), set(info['removed']), set(info['modified']))
+    elif LABEL_BACKEND == "memory" and not SHARED_DATASET and 'store' in previous:
+        t1 = time.perf_counter()
+        added, removed, modified = diff_stores(previous['store'], ds['store'])
+        change_log.record(previous.generation, ds.generation, added, removed, modified)
+        print(f"Generation {ds.generation}: {len(added)} added, {len(removed)} removed, {len(modified)} modified "
+              f"({time.perf_counter() - t1:.2f}s).")
+    else:
+        # no row diff for the SQLite backend, delta clients fall back to a full resync
+        change_log.reset(ds.generation)
+    t2 = time.perf_counter()
+    load_progress.enter('payload')
+    initial_payload(ds)
+    print(f"Built initial /api/labels payload in {time.perf_counter() - t2:.2f}s.")
+    load_progress.done()
+    print(f"Data loading complete (generation {ds.generation}).")
+
+initial_payloads = PayloadCache()
+query_cache = QueryCache(QUERY_CACHE_SIZE, int(QUERY_CACHE_MB * 1024 * 1024))
+change_log = ChangeLog(DELTA_GENERATIONS)
+load_progress = LoadProgress()
+
+LABEL_FORMATS = {"full": labels_json, "compact": compact_labels_json}
 
-    data = sort_video_labels_by_date(converted_data)
-    print("Data loading complete.")
+def label_format(qp):
+    """video_labels encoder picked by the format query param."""
+    fmt = qp.get("format", "full")
+    if fmt not in LABEL_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format '{fmt}', expected one of {list(LABEL_FORMATS)}")
+    if fmt == "compact" and LABEL_BACKEND != "memory":
+        raise HTTPException(status_code=400, detail="format=compact needs LABEL_BACKEND=memory")
+    return fmt
+
+def initial_payload(ds, today=None, fmt="full"):
+    """The no-filter /api/labels body, serialized and compressed once per generation and format (and per day, for the end date)."""
+    today = today or datetime.now().date()
+    def build():
+        before = {
+            "sites": {v['site']: v['gps'] for v in ds['sites'].values()},
+            "animals": ['none'] + [item for item in ds['sorted_videos']['animal_videos'].keys() if item != 'none'],
+            "actions": ['none'] + list(ds['sorted_videos']['actions'].keys()),
+            "add_labels": ['none'] + list(ds['sorted_videos']['additional_labels'].keys()),
+        }
+        after = {
+            # default to 1/1/2020
+            "start": datetime(2020, 1, 1).date(),
+            "end": today,
+            "restricted": default_restricted
+        }
+        store = ds['store']
+        return encode_labels_payload(before, LABEL_FORMATS[fmt](store, range(len(store))), after)
+    return initial_payloads.get((ds.generation, today, fmt), build)
+
+def run_query(ds, filters):
+    """Matching row ids (in date order) and per-value facet counts for one set of filters."""
+    return query_rows(ds, FILTER_ENGINE, filters.sites, filters.animals, filters.actions, filters.add_labels,
+                      [filters.start, filters.end], filters.restricted, filters.query)
+
+async def watch_label_file(stop_event):
+    """Rebuilds the dataset in a worker thread whenever the label JSON changes on disk, until stop_event is set."""
+    path, _ = get_json_path()
+    # Watch the directory, editors and sync tools often replace the file rather than write it in place
+    watch_filter = lambda change, changed: os.path.abspath(changed) == os.path.abspath(path)
+    async for _ in awatch(os.path.dirname(path), watch_filter=watch_filter, stop_event=stop_event):
+        print(f"Label file changed, reloading {path}")
+        try:
+            await run_in_threadpool(load_data_into_memory)
+        except LoadCancelled:
+            return
+        except Exception as e:
+            load_progress.failed(e)
+            print(f"Reload failed, keeping the current data: {e!r}")
 
 # --- FastAPI event handler to run on startup ---
 app = FastAPI()
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], expose_headers=[GENERATION_HEADER, "ETag", "Retry-After"])
+
+async def load_and_watch(stop_event):
+    """Loads the data in a worker thread, then watches the label file for changes until stop_event is set."""
+    # a launcher worker that replaces another one loads before it serves (see serve.py); when
+    # that failed, it doesn't load the same file again but waits for it to change
+    if dataset.current().generation == 0 and load_progress.phase != 'failed':
+        try:
+            await run_in_threadpool(load_data_into_memory)
+        except LoadCancelled:
+            print("Shutting down, data loading cancelled.")
+            return
+        except Exception as e:
+            load_progress.failed(e)
+            traceback.print_exc()
+            print("Data loading failed, not ready until the label file changes." if WATCH_LABEL_FILE else "Data loading failed.")
+    if WATCH_LABEL_FILE:
+        await watch_label_file(stop_event)
+
+async def wait_or_stop(stop_event, seconds):
+    """Sleeps for seconds; True when stop_event was set meanwhile."""
+    try:
+        await asyncio.wait_for(stop_event.wait(), max(0, seconds))
+    except asyncio.TimeoutError:
+        pass
+    return stop_event.is_set()
+
+async def prewarm_payloads(stop_event):
+    """Builds the next day's initial payloads shortly before midnight, until stop_event is set,
+    so the first requests of the day don't wait for them."""
+    while True:
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        if await wait_or_stop(stop_event, (midnight - now).total_seconds() - PAYLOAD_PREWARM_SECONDS):
+            return
+        ds = dataset.current()
+        if ds.generation == 0:
+            # still loading, look again shortly
+            if await wait_or_stop(stop_event, 5):
+                return
+            continue
+        if datetime.now() < midnight:
+            try:
+                # the full format, and any other one the current generation is being served in
+                for fmt in {"full"} | {key[2] for key in initial_payloads.keys() if key[0] == ds.generation}:
+                    await run_in_threadpool(initial_payload, ds, midnight.date(), fmt)
+                print(f"Built the initial /api/labels payloads for {midnight.date()}.")
+            except Exception as e:
+                print(f"Could not build the initial /api/labels payloads for {midnight.date()}: {e!r}")
+        if await wait_or_stop(stop_event, (midnight - datetime.now()).total_seconds() + 1):
+            return
 
 @app.on_event("startup")
-def startup_event():
-    """Event handler to load data into memory when the app starts."""
-    load_data_into_memory()
+async def startup_event():
+    """Event handler that starts loading data into memory in the background, so the port opens right away;
+    /api/health/ready reports the progress and data endpoints answer 503 until it is done."""
+    app.state.stopping = asyncio.Event()
+    app.state.label_loader = asyncio.create_task(load_and_watch(app.state.stopping))
+    app.state.payload_prewarmer = asyncio.create_task(prewarm_payloads(app.state.stopping))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    load_progress.cancel()
+    app.state.stopping.set()
+    await app.state.label_loader
+    await app.state.payload_prewarmer
+    if dataset.current().get('shards') is not None:
+        dataset.current()['shards'].close()
+
+@app.get("/api/health/live")
+def get_liveness():
+    """Liveness probe: answers as soon as the server is up, whether or not the data has loaded."""
+    return {"status": "ok"}
+
+@app.get("/api/health/ready")
+def get_readiness(response: Response):
+    """Readiness probe: 200 once a dataset is being served, 503 with Retry-After until then.
+    Either way the body has the phase and percent done of the running (or last) load."""
+    ds = dataset.current()
+    body = {"ready": ds.generation != 0, "generation": ds.generation, **load_progress.status()}
+    if not body["ready"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        response.headers["Retry-After"] = str(load_progress.retry_after())
+    return body
 
 @app.post("/token")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
@@ -121,51 +444,125 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/api/labels")
-def get_labels(request: Request, current_user: str = Depends(get_current_user)):
+def get_labels(request: Request, current_user: str = Depends(get_current_user), ds: dataset.Dataset = Depends(get_dataset)):
     qp = request.query_params
+    if_none_match = request.headers.get("if-none-match")
 
     # If no filters are provided, this is the initial load, return all entries
-    if len(qp) == 0:
+    fmt = label_format(qp)
+    if not any(p in qp for p in FILTER_PARAMS):
+        enc = choose_encoding(request.headers.get("accept-encoding"), ENCODINGS)
+        today = datetime.now().date()
+        etag = make_etag(ds, "initial", today, enc, fmt)
+        headers = {GENERATION_HEADER: str(ds.generation), "ETag": etag, "Vary": "Accept-Encoding"}
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag, headers)
         print("No filters provided, returning all entries.")
-        # Add elevation data to all videos
-        elevations = {v['site']: v['elevation'] for v in data['sites'].values()}
-        for vid, labels in data['video_labels'].items():
-            site = labels.get('site')
-            if site in elevations:
-                data['video_labels'][vid]['elevation'] = elevations[site]
-        return {
-            "sites": {v['site']: v['gps'] for v in data['sites'].values()},
-            "animals": ['none'] + [item for item in data['sorted_videos']['animal_videos'].keys() if item != 'none'],
-            "actions": ['none'] + list(data['sorted_videos']['actions'].keys()),
-            "add_labels": ['none'] + list(data['sorted_videos']['additional_labels'].keys()),
-            "video_labels": data['video_labels'],
-            # default to 1/1/2020
-            "start": datetime(2020, 1, 1).date(),
-            "end": datetime.now().date(),
-            "restricted": default_restricted
-        }
-    
+        # Pre-serialized per generation; elevation is filled in from the site table by the label store
+        return initial_payload(ds, today, fmt).response(enc, headers)
+
     # Get filter parameters - empty lists mean no selection for that category
-    sites = qp.get("sites")
-    animals = qp.get("animals").split(",")
-    actions = qp.get("actions").split(",")
-    add_labels = qp.get("add_labels").split(",")
-    start = qp.get("start")
-    end = qp.get("end")
-    restricted = qp.get("restricted")
-    
-    videos = resort_all_data(data, sites, animals, actions, add_labels, [start, end], restricted)
-    subset_labels = {v: data['video_labels'][v] for v in videos}
-
-    rsub = reverse_subset(videos, data['video_labels'])
-    print(f"Returning {len(subset_labels)} video labels after filtering.")
+    try:
+        filters = parse_filters(qp)
+        page = parse_page(qp)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filter parameters: {e}")
+    stream = qp.get("stream")
+    if stream not in (None, "ndjson"):
+        raise HTTPException(status_code=400, detail="Invalid filter parameters: stream must be 'ndjson'")
+    if stream and fmt != "full":
+        raise HTTPException(status_code=400, detail="Invalid filter parameters: stream only supports the full format")
+    debug = qp.get("debug")
+    if debug not in (None, "plan"):
+        raise HTTPException(status_code=400, detail="Invalid filter parameters: debug must be 'plan'")
+    etag = make_etag(ds, "filtered", filters.key(), page.key() if page else "", stream or "", fmt, debug or "")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, {GENERATION_HEADER: str(ds.generation)})
+
+    rows, facets = query_cache.get(ds.generation, filters, lambda: run_query(ds, filters))
+    store = ds['store']
+    result = {
+        "reverse_subset": {name: list(counts) for name, counts in facets.items()},
+        "facet_counts": facets,
+    }
+    if debug == "plan":
+        result["plan"] = explain_query(ds, FILTER_ENGINE, filters.sites, filters.animals, filters.actions, filters.add_labels,
+                                       [filters.start, filters.end], filters.restricted, filters.query)
+    if page is not None:
+        # Paginated: only this page's rows are rebuilt, in the same date order
+        try:
+            start, rows_page, next_cursor = page_rows(rows, page, ds.generation)
+        except LookupError as e:
+            raise HTTPException(status_code=410, detail=str(e))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        result.update(total=len(rows), offset=start, limit=page.limit, next_cursor=next_cursor)
+        rows = rows_page
+
+    if stream == "ndjson":
+        # Header line with the facets first, then one video per line as it is produced
+        print(f"Streaming {len(rows)} video labels after filtering.")
+        result.setdefault("total", len(rows))
+        headers = {GENERATION_HEADER: str(ds.generation), "ETag": etag}
+        return StreamingResponse(ndjson_lines(result, store, rows), media_type="application/x-ndjson", headers=headers)
+
+    print(f"Returning {len(rows)} video labels after filtering.")
+    body = encode_labels_payload({}, LABEL_FORMATS[fmt](store, rows), result)
+    return Response(body, media_type="application/json", headers={GENERATION_HEADER: str(ds.generation), "ETag": etag})
+
+@app.get("/api/labels/delta")
+def get_labels_delta(since: str, current_user: str = Depends(get_current_user), ds: dataset.Dataset = Depends(get_dataset)):
+    """Videos added, modified or removed since the generation a client last saw.
+
+    When the change log no longer reaches back to since (too old, or from
+    another server process) the client is told to do a full resync instead.
+    """
+    try:
+        since = int(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid since: must be a generation number")
+    changes = change_log.since(since, ds.generation)
+    if changes is None:
+        return {"generation": ds.generation, "full_resync": True}
+    added, removed, modified = changes
+    store = ds['store']
+    rows = lambda keys: {k: store.row(store.key_ids[k]) for k in sorted(keys)}
+    return {
+        "generation": ds.generation,
+        "since": since,
+        "full_resync": False,
+        "added": rows(added),
+        "modified": rows(modified),
+        "removed": sorted(removed),
+    }
+
+@app.get("/api/labels/preview")
+def get_labels_preview(request: Request, response: Response, current_user: str = Depends(get_current_user), ds: dataset.Dataset = Depends(get_dataset)):
+    """For the current filter state, how many videos each single toggle (site, label or restricted) would leave."""
+    if LABEL_BACKEND != "memory":
+        raise HTTPException(status_code=501, detail="preview needs LABEL_BACKEND=memory")
+    try:
+        filters = parse_filters(request.query_params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filter parameters: {e}")
+    etag = make_etag(ds, "preview", filters.key())
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag, {GENERATION_HEADER: str(ds.generation)})
+    response.headers["ETag"] = etag
+    return query_cache.get(ds.generation, ("preview", filters), lambda: preview_all_data(
+        ds, filters.sites, filters.animals, filters.actions, filters.add_labels,
+        [filters.start, filters.end], filters.restricted, filters.query))
+
+@app.get("/api/stats")
+def get_stats(current_user: str = Depends(get_current_user), ds: dataset.Dataset = Depends(get_dataset)):
+    """Counters for the in-memory caches."""
     return {
-        "video_labels": subset_labels,
-        "reverse_subset": rsub,
+        "generation": ds.generation,
+        "query_cache": query_cache.stats(),
     }
 
 @app.get("/api/video")
-def get_video(request: Request, path: str, token: Optional[str] = None):
+def get_video(request: Request, path: str, token: Optional[str] = None, ds: dataset.Dataset = Depends(get_dataset)):
     # Handle token from query params for video streaming
     if token:
         try:
@@ -180,7 +577,7 @@ def get_video(request: Request, path: str, token: Optional[str] = None):
     else:
         print("No token provided in request")
         raise HTTPException(status_code=401, detail="Missing token")
-    if path not in data['video_labels']:
+    if path not in ds['video_labels']:
         print(f"Video path '{path}' not indexed in data.")
         raise HTTPException(status_code=404, detail="Video not indexed")
     if not os.path.exists(path):
@@ -211,9 +608,12 @@ def get_video(request: Request, path: str, token: Optional[str] = None):
         "Content-Range": f"bytes {start}-{end}/{file_size}",
         "Accept-Ranges": "bytes",
         "Content-Length": str(end - start + 1),
+        GENERATION_HEADER: str(ds.generation),
     }
     return StreamingResponse(iterfile(path, start, end), status_code=206, media_type=media_type, headers=headers)
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("main_server:app", host="0.0.0.0", port=APP_PORT, reload=True)
+    import sys, serve
+    # serve this module rather than have the launcher import it a second time
+    sys.modules.setdefault("main_server", sys.modules[__name__])
+    serve.main()
@@ -0,0 +1,116 @@
+# backend/numpy_engine.py
+from array import array
+from label_store import CATEGORIES, F_RESTRICTED_TRUE
+
+try:
+    import numpy as np
+except ImportError:  # optional, the bitmap index needs nothing beyond the stdlib
+    np = None
+
+class NumpyIndex:
+    """Vectorized filter engine over the columns of a LabelStore.
+
+    Sites and times are integer arrays, and each label category is kept as its
+    CSR id array plus the owning row of every id. A query is then a handful of
+    mask operations over the rows in the date window, found by searchsorted.
+    """
+
+    def __init__(self, store):
+        if np is None:
+            raise RuntimeError("FILTER_ENGINE=numpy requires numpy to be installed")
+        self.store = store
+        self.n = n = len(store)
+        # frombuffer shares memory with the arrays, or the snapshot mapping
+        self.site_ids = np.frombuffer(store.site_ids, dtype=np.uint32, count=n)
+        self.times = np.frombuffer(store.times, dtype=np.int64, count=n)
+        self.restricted = (np.frombuffer(store.flags, dtype=np.uint8, count=n) & F_RESTRICTED_TRUE) != 0
+        for i, extra in store.extras.items():
+            if 'restricted' in extra:
+                self.restricted[i] = bool(extra['restricted'])
+        self.site_lookup = {s: i for i, s in enumerate(store.site_vocab) if isinstance(s, str)}
+        self.label_lookup = {v: i for i, v in enumerate(store.label_vocab) if isinstance(v, str)}
+        self.labels = {}
+        for c in CATEGORIES:
+            offsets, ids = store.label_columns[c]
+            offsets = np.frombuffer(offsets, dtype=np.uint32, count=n + 1).astype(np.int64)
+            # a sliced store's offsets point into the whole store's id array
+            ids = np.frombuffer(ids, dtype=np.uint32, count=int(offsets[-1]))[offsets[0]:]
+            offsets -= offsets[0]
+            counts = np.diff(offsets)
+            owner = np.repeat(np.arange(n, dtype=np.int64), counts)
+            # a label listed twice on one video must still count that video once
+            repeats = len(np.unique(owner * len(store.label_vocab) + ids)) != len(ids)
+            self.labels[c] = (offsets, ids, owner, counts == 0, repeats)
+
+    def _wanted(self, lookup, size, wanted):
+        table = np.zeros(size, dtype=bool)
+        table[[lookup[w] for w in wanted if w in lookup]] = True
+        return table
+
+    def _labels_mask(self, category, wanted, lo, hi):
+        offsets, ids, owner, empty, _ = self.labels[category]
+        a, b = offsets[lo], offsets[hi]
+        hit = self._wanted(self.label_lookup, len(self.store.label_vocab), wanted)[ids[a:b]]
+        mask = np.zeros(hi - lo, dtype=bool)
+        mask[owner[a:b][hit] - lo] = True
+        # 'none' selects videos without any label in this category
+        if 'none' in wanted:
+            mask |= empty[lo:hi]
+        return mask
+
+    def date_range(self, start, end):
+        """Rows [lo, hi) whose epoch time lies in [start, end]; rows are in time order."""
+        return (int(np.searchsorted(self.times, start, 'left')),
+                int(np.searchsorted(self.times, end, 'right')))
+
+    def match(self, sites, animals, actions, add_labels, restricted, lo=0, hi=None):
+        """Row ids (ascending) in rows [lo, hi) passing the site / label / restricted filters."""
+        hi = self.n if hi is None else hi
+        if hi <= lo:
+            return array('I')
+        mask = self._wanted(self.site_lookup, len(self.store.site_vocab), sites)[self.site_ids[lo:hi]]
+        if restricted:
+            mask &= ~self.restricted[lo:hi]
+        for wanted, category in ((animals, 'animals'), (actions, 'actions'), (add_labels, 'additional_labels')):
+            if not mask.any():
+                break
+            mask &= self._labels_mask(category, wanted, lo, hi)
+        return array('I', (np.flatnonzero(mask) + lo).astype(np.uint32).tobytes())
+
+    def select(self, rows, bits):
+        """The rows whose bit is set in an index bitset (e.g. a q expression), order kept."""
+        packed = np.frombuffer(bits.to_bytes((self.n + 7) // 8, 'little'), dtype=np.uint8)
+        mask = np.unpackbits(packed, bitorder='little')[:self.n].astype(bool)
+        rows = np.frombuffer(rows, dtype=np.uint32)
+        return array('I', rows[mask[rows]].tobytes())
+
+    def facets(self, rows):
+        """Per-value counts of the videos in rows, the same shape as LabelIndex.facets."""
+        rows = np.frombuffer(rows, dtype=np.uint32).astype(np.int64) if len(rows) else np.zeros(0, np.int64)
+        store = self.store
+        site_counts = np.bincount(self.site_ids[rows], minlength=len(store.site_vocab))
+        facets = {'sites': {s: int(site_counts[i]) for i, s in enumerate(store.site_vocab) if s and site_counts[i]}}
+        selected = np.zeros(self.n, dtype=bool)
+        selected[rows] = True
+        none_id = self.label_lookup.get('none')
+        for c, name in zip(CATEGORIES, ('animals', 'actions', 'add_labels')):
+            offsets, ids, owner, empty, repeats = self.labels[c]
+            in_rows = selected[owner]
+            present = ids[in_rows]
+            if repeats:
+                size = len(store.label_vocab)
+                present = np.unique(owner[in_rows] * size + present) % size
+            counts = np.bincount(present, minlength=len(store.label_vocab))
+            none = empty & selected
+            if none_id is not None:
+                # rows with an explicit 'none' label count once, even when also unlabelled
+                none[owner[in_rows & (ids == none_id)]] = True
+            result = facets[name] = {}
+            none_count = int(none.sum())
+            if none_count:
+                result['none'] = none_count
+            for j in np.flatnonzero(counts):
+                value = store.label_vocab[j]
+                if value != 'none':
+                    result[value] = int(counts[j])
+        return facets
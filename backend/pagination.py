@@ -0,0 +1,55 @@
+# backend/pagination.py
+import base64
+from bisect import bisect_right
+from typing import NamedTuple, Optional
+
+MAX_PAGE_SIZE = 5000
+
+class Page(NamedTuple):
+    """Requested window over a filtered result: offset/limit, or an opaque cursor."""
+    limit: int
+    offset: int = 0
+    cursor: Optional[str] = None
+
+    def key(self):
+        return f"{self.limit}:{self.offset}:{self.cursor or ''}"
+
+def encode_cursor(generation, row):
+    return base64.urlsafe_b64encode(f"{generation}:{row}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """(generation, row) from a cursor; raises ValueError when it is malformed."""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    generation, row = raw.split(":")
+    return int(generation), int(row)
+
+def parse_page(qp):
+    """Page from query params, or None for the full (unpaginated) response; raises ValueError on bad values."""
+    limit, offset, cursor = qp.get("limit"), qp.get("offset"), qp.get("cursor")
+    if limit is None and offset is None and cursor is None:
+        return None
+    limit = int(limit) if limit else MAX_PAGE_SIZE
+    offset = int(offset) if offset else 0
+    if not 0 < limit <= MAX_PAGE_SIZE or offset < 0:
+        raise ValueError(f"limit must be 1..{MAX_PAGE_SIZE} and offset >= 0")
+    if cursor and offset:
+        raise ValueError("use either offset or cursor, not both")
+    return Page(limit, offset, cursor or None)
+
+def page_rows(rows, page, generation):
+    """(start, page of rows, next cursor or None) out of the sorted row ids of a result.
+
+    A cursor names the last row of the previous page, so the next page starts
+    with one bisection and costs O(limit) whatever its depth. Cursors are tied
+    to a dataset generation; a stale one raises LookupError.
+    """
+    if page.cursor:
+        cursor_generation, after = decode_cursor(page.cursor)
+        if cursor_generation != generation:
+            raise LookupError("cursor belongs to an older dataset generation")
+        start = bisect_right(rows, after)
+    else:
+        start = page.offset
+    chunk = rows[start:start + page.limit]
+    more = start + len(chunk) < len(rows)
+    return start, chunk, encode_cursor(generation, chunk[-1]) if more and len(chunk) else None
@@ -0,0 +1,152 @@
+# backend/partitions.py
+import hashlib
+from array import array
+from bisect import bisect_left
+from functools import cached_property
+from label_index import LabelIndex, bit_positions
+from label_store import CATEGORIES
+from sorting import from_epoch, to_epoch
+from query_dsl import evaluate
+
+def month_starts(first, last):
+    """Epoch seconds of the first instant of each month from first's month through last's."""
+    d = from_epoch(first)
+    year, month = d.year, d.month
+    end = from_epoch(last)
+    starts = []
+    while (year, month) <= (end.year, end.month):
+        starts.append(to_epoch(f"{year:04d}-{month:02d}-01"))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return starts
+
+def _extends(vocab, old):
+    return len(vocab) >= len(old) and all(a == b for a, b in zip(vocab, old))
+
+class Partition:
+    """One calendar month of the dataset: rows [lo, hi) of the store, with its own LabelIndex.
+
+    The index works in partition-local row numbers (bit j = row lo + j), so it
+    stays valid when earlier months grow or shrink and can be reused as is.
+    """
+
+    def __init__(self, month, lo, hi, index):
+        self.month = month  # "YYYY-MM"
+        self.lo = lo
+        self.hi = hi
+        self.index = index
+
+    @cached_property
+    def digest(self):
+        """Hash of the partition's rows; equal digests mean the local index can be reused."""
+        store = self.index.store
+        h = hashlib.blake2b(digest_size=16)
+        h.update('\0'.join(store.keys).encode('utf-8', 'surrogatepass'))
+        for col in (store.site_ids, store.times, store.time_fmt, store.flags):
+            h.update(col)
+        for c in CATEGORIES:
+            offsets, ids = store.label_columns[c]
+            base = offsets[0]
+            h.update(array('I', [o - base for o in offsets]).tobytes())
+            h.update(memoryview(ids)[base:offsets[-1]])
+        h.update(repr(sorted(store.extras.items())).encode('utf-8', 'surrogatepass'))
+        return h.hexdigest()
+
+class PartitionedIndex:
+    """Monthly partitions of a LabelStore, each with its own bitset index.
+
+    A query only touches the partitions overlapping its date window, and works
+    on month-sized bitsets instead of ones spanning the whole dataset.
+    """
+
+    # Past this fraction of months in the window, one pass over the whole-store
+    # bitsets is cheaper than per-partition facets
+    PRUNE_FRACTION = 0.5
+
+    def __init__(self, store, partitions):
+        self.store = store
+        self.partitions = partitions
+
+    @classmethod
+    def build(cls, store, previous=None, index=None):
+        """Partition store by month.
+
+        Months whose rows are unchanged since previous (a PartitionedIndex of
+        the last generation, sharing its vocabularies) keep their bitsets.
+        Otherwise the bitsets are cut out of index when given, or built.
+        Returns the PartitionedIndex and the number of partitions rebuilt.
+        """
+        times = store.times
+        old = {}
+        if previous is not None and _extends(store.site_vocab, previous.store.site_vocab) \
+                and _extends(store.label_vocab, previous.store.label_vocab):
+            # ids mean the same in both stores, so equal column bytes mean equal rows
+            old = {p.month: p for p in previous.partitions}
+        partitions = []
+        rebuilt = 0
+        if len(store):
+            starts = month_starts(times[0], times[len(store) - 1])
+            for start, end in zip(starts, starts[1:] + [None]):
+                lo = bisect_left(times, start)
+                hi = bisect_left(times, end) if end is not None else len(store)
+                if lo == hi:
+                    continue
+                sub = store.slice(lo, hi)
+                month = from_epoch(start).strftime("%Y-%m")
+                part = Partition(month, lo, hi, None)
+                reuse = old.get(month)
+                if reuse is not None:
+                    part.index = LabelIndex(sub, reuse.index.sites, reuse.index.values, reuse.index.empty, reuse.index.restricted)
+                    if part.digest != reuse.digest:
+                        reuse = None
+                if reuse is None:
+                    rebuilt += 1
+                    part.index = index.cut(sub, lo, hi) if index is not None else LabelIndex.build(sub)
+                partitions.append(part)
+        return cls(store, partitions), rebuilt
+
+    def merged(self):
+        """A whole-store LabelIndex assembled from the partition bitsets."""
+        sites, values = {}, {c: {} for c in CATEGORIES}
+        empty, restricted = {c: 0 for c in CATEGORIES}, 0
+        for p in self.partitions:
+            idx, lo = p.index, p.lo
+            for s, b in idx.sites.items():
+                sites[s] = sites.get(s, 0) | (b << lo)
+            for c in CATEGORIES:
+                table = values[c]
+                for v, b in idx.values[c].items():
+                    table[v] = table.get(v, 0) | (b << lo)
+                empty[c] |= idx.empty[c] << lo
+            restricted |= idx.restricted << lo
+        return LabelIndex(self.store, sites, values, empty, restricted)
+
+    def overlapping(self, start, end):
+        """Partitions with at least one row whose epoch time lies in [start, end]."""
+        times = self.store.times
+        return [p for p in self.partitions if times[p.lo] <= end and times[p.hi - 1] >= start]
+
+    def pruned(self, start, end):
+        """The partitions a query over [start, end] should scan, or None when pruning doesn't pay."""
+        scanned = self.overlapping(start, end)
+        if len(scanned) > self.PRUNE_FRACTION * len(self.partitions):
+            return None
+        return scanned
+
+    def query(self, partitions, sites, animals, actions, add_labels, restricted, start, end, query=None):
+        """Matching row ids (in date order) and facet counts from the given partitions (see pruned)."""
+        rows = array('I')
+        facets = {'sites': {}, 'animals': {}, 'actions': {}, 'add_labels': {}}
+        for p in partitions:
+            idx = p.index
+            lo, hi = idx.date_range(start, end)
+            bits = idx.match(sites, animals, actions, add_labels, restricted, lo, hi)
+            if query is not None and bits:
+                bits &= evaluate(query, idx)
+            if not bits:
+                continue
+            rows.extend(p.lo + i for i in bit_positions(bits))
+            for name, counts in idx.facets(bits).items():
+                merged = facets[name]
+                for value, count in counts.items():
+                    merged[value] = merged.get(value, 0) + count
+        return rows, facets
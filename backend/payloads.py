@@ -0,0 +1,173 @@
+# backend/payloads.py
+import json, gzip, threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from collections.abc import Mapping
+from datetime import date
+from fastapi import Response
+from label_store import CATEGORIES, LABEL_FLAGS, F_SITE, F_RESTRICTED, F_RESTRICTED_TRUE, Interner
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+GZIP_LEVEL = 6
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+BROTLI_QUALITY = 5  # higher levels take seconds per MB for little gain on label JSON
+
+def _default(obj):
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps(obj):
+    """json.dumps with the same settings FastAPI's JSONResponse uses."""
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default)
+
+def encode_labels_payload(before, video_labels_json, after):
+    """UTF-8 JSON for {**before, "video_labels": ..., **after}, with video_labels already encoded."""
+    parts = ['{']
+    for k, v in before.items():
+        parts += [dumps(k), ':', dumps(v), ',']
+    parts += ['"video_labels":', video_labels_json]
+    for k, v in after.items():
+        parts += [',', dumps(k), ':', dumps(v)]
+    parts.append('}')
+    return ''.join(parts).encode('utf-8')
+
+def labels_json(store, rows):
+    """video_labels as {path: label dict}, encoded one row at a time."""
+    return '{' + ','.join(dumps(key) + ':' + dumps(labels) for key, labels in store.items(rows)) + '}'
+
+COMPACT_COLUMNS = ["prefix", "name", "site", "time", "time_format", "animals", "actions", "additional_labels", "restricted"]
+
+def compact_labels_json(store, rows):
+    """Dictionary-encoded video_labels (format=compact).
+
+    Site, label and directory-prefix strings are sent once in tables; each video
+    is then one array of COMPACT_COLUMNS: prefix id, file name, site id, epoch
+    seconds, how the time was written (label_store's TIME_ISO, TIME_DATE or
+    TIME_VERBATIM), label id lists and a 0/1 restricted flag. Fields the video
+    doesn't have are null, so expanding a row gives back exactly the full format.
+    Row values that don't fit the columns are sent as-is in "extras", keyed by
+    row number.
+    """
+    keys, flags, site_ids, times, time_fmt = store.keys, store.flags, store.site_ids, store.times, store.time_fmt
+    columns = [(LABEL_FLAGS[c], *store.label_columns[c]) for c in CATEGORIES]
+    prefixes = Interner()
+    extras = {}
+    encoded = []
+    for n, i in enumerate(rows):
+        key = keys[i]
+        cut = max(key.rfind('/'), key.rfind('\\')) + 1
+        f = flags[i]
+        row = [prefixes(key[:cut]), key[cut:], site_ids[i] if f & F_SITE else None, times[i], time_fmt[i]]
+        for flag, offsets, ids in columns:
+            row.append(list(ids[offsets[i]:offsets[i + 1]]) if f & flag else None)
+        row.append((1 if f & F_RESTRICTED_TRUE else 0) if f & F_RESTRICTED else None)
+        encoded.append(dumps(row))
+        extra = store.extras.get(i)
+        if extra:
+            extras[str(n)] = extra
+    head = {
+        "format": "compact-v2",
+        "columns": COMPACT_COLUMNS,
+        "sites": store.site_vocab,
+        "elevations": [store.elevations.get(s) for s in store.site_vocab],
+        "labels": store.label_vocab,
+        "prefixes": prefixes.values,
+        "extras": extras,
+    }
+    return dumps(head)[:-1] + ',"rows":[' + ','.join(encoded) + ']}'
+
+def ndjson_lines(header, store, rows, batch=256):
+    """NDJSON body: the header object first, then one {"path", "labels"} line per row.
+
+    Rows are rebuilt as they are written and sent in small batches, so memory
+    stays flat however large the result is.
+    """
+    yield (dumps(header) + '\n').encode('utf-8')
+    lines = []
+    for key, labels in store.items(rows):
+        lines.append(dumps({"path": key, "labels": labels}))
+        if len(lines) >= batch:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+def choose_encoding(accept_encoding, available):
+    """Best of available ('br', 'gzip') the client accepts, or 'identity'."""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for enc in ('br', 'gzip'):
+        if enc in available and accepted.get(enc, accepted.get('*', 0.0)) > 0:
+            return enc
+    return 'identity'
+
+class EncodedPayload:
+    """A response body serialized once, with gzip and (if available) brotli variants."""
+
+    def __init__(self, body, media_type='application/json'):
+        self.media_type = media_type
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, GZIP_LEVEL)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, mode=brotli.MODE_TEXT, quality=BROTLI_QUALITY)
+
+    def response(self, enc, headers=None):
+        """Response with the enc variant (see choose_encoding)."""
+        headers = dict(headers or {}, Vary='Accept-Encoding')
+        if enc != 'identity':
+            headers['Content-Encoding'] = enc
+        # Response sets Content-Length from the (already encoded) body
+        return Response(self.variants[enc], media_type=self.media_type, headers=headers)
+
+class PayloadCache:
+    """Holds the payloads for the few most recent keys; concurrent misses wait for a single build."""
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._payloads = OrderedDict()  # key -> Future of the EncodedPayload
+
+    def keys(self):
+        with self._lock:
+            return list(self._payloads)
+
+    def get(self, key, build):
+        """The payload for key, built with build() on a miss.
+
+        The build (seconds for a large dataset) runs outside the lock, so
+        requests for other keys are served meanwhile; only requests for this
+        key wait for it, and a failed build is retried by the next request.
+        """
+        with self._lock:
+            future = self._payloads.get(key)
+            building = future is None
+            if building:
+                future = self._payloads[key] = Future()
+                while len(self._payloads) > self.maxsize:
+                    self._payloads.popitem(last=False)
+            self._payloads.move_to_end(key)
+        if building:
+            try:
+                future.set_result(EncodedPayload(build()))
+            except BaseException as e:
+                with self._lock:
+                    if self._payloads.get(key) is future:
+                        del self._payloads[key]
+                future.set_exception(e)
+                raise
+        return future.result()
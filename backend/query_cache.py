@@ -0,0 +1,85 @@
+# backend/query_cache.py
+import sys, threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+import dataset
+
+def result_nbytes(value):
+    """Approximate memory held by a cached result: arrays by their buffer, containers by their items."""
+    if isinstance(value, array):
+        return sys.getsizeof(value)
+    if isinstance(value, Mapping):
+        return sys.getsizeof(value) + sum(result_nbytes(k) + result_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(result_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+class QueryCache:
+    """Bounded LRU of filtered query results for the current dataset generation.
+
+    Keys are canonical Filters; the first request on a newly published generation
+    drops every entry. Requests still running against an older one compute without caching.
+    Bounded both by entry count and by the approximate bytes the results hold
+    (a broad query on a large dataset is megabytes of row ids); a result over a
+    quarter of maxbytes is returned without being cached.
+    """
+
+    def __init__(self, maxsize=256, maxbytes=64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.generation = None
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.oversized = 0
+
+    def get(self, generation, key, compute):
+        with self._lock:
+            if generation != self.generation and generation == dataset.current().generation:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self.nbytes = 0
+                self.generation = generation
+            if generation == self.generation and key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        value = compute()  # outside the lock; a concurrent miss may compute the same value
+        nbytes = result_nbytes(value)
+        with self._lock:
+            if nbytes > self.maxbytes // 4:
+                self.oversized += 1
+            elif generation == self.generation and self.maxsize > 0:
+                if key in self._entries:
+                    self.nbytes -= self._entries[key][1]
+                self._entries[key] = (value, nbytes)
+                self._entries.move_to_end(key)
+                self.nbytes += nbytes
+                while len(self._entries) > self.maxsize or self.nbytes > self.maxbytes:
+                    _, (_, dropped) = self._entries.popitem(last=False)
+                    self.nbytes -= dropped
+                    self.evictions += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "generation": self.generation,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "bytes": self.nbytes,
+                "maxbytes": self.maxbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "oversized": self.oversized,
+            }
@@ -0,0 +1,186 @@
+# backend/query_dsl.py
+"""Boolean filter expressions for /api/labels?q=...
+
+    deer AND fawn
+    coyote AND NOT site:"Salt Lick"
+    (animal:deer OR animal:turkey) NOT label:night
+    animal:none AND restricted:false
+
+Terms are field:value, or a bare value that matches any label category.
+Fields: site, animal, action, label (additional labels) and restricted
+(true/false). AND, OR and NOT are case-insensitive, parentheses group, and
+terms written side by side are ANDed. Values with spaces or special
+characters are double-quoted. 'none' selects videos without any label in
+that category, as it does for the plain filter params.
+"""
+import re
+
+FIELDS = {
+    'site': 'sites', 'sites': 'sites',
+    'animal': 'animals', 'animals': 'animals',
+    'action': 'actions', 'actions': 'actions',
+    'label': 'additional_labels', 'labels': 'additional_labels', 'add_labels': 'additional_labels',
+    'additional_labels': 'additional_labels',
+    'restricted': 'restricted',
+}
+LABEL_FIELDS = ('animals', 'actions', 'additional_labels')
+MAX_LENGTH = 2000
+MAX_DEPTH = 32
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()":]+)|(:))')
+
+def _tokens(text):
+    """(kind, value) pairs: '(' ')' ':', ('word', text) or ('quoted', text)."""
+    pos, tokens = 0, []
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if not m:
+            raise ValueError(f"unexpected character at {pos}: {text[pos]!r}")
+        lparen, rparen, quoted, word, colon = m.groups()
+        if lparen or rparen or colon:
+            tokens.append((lparen or rparen or colon, None))
+        elif quoted is not None:
+            tokens.append(('quoted', re.sub(r'\\(.)', r'\1', quoted)))
+        else:
+            tokens.append(('word', word))
+        pos = m.end()
+    return tokens
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def keyword(self, name):
+        kind, value = self.peek()
+        if kind == 'word' and value.upper() == name:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.or_expr()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"unexpected {self.peek()[1] or self.peek()[0]!r}")
+        return node
+
+    def or_expr(self):
+        nodes = [self.and_expr()]
+        while self.keyword('OR'):
+            nodes.append(self.and_expr())
+        return _combine('or', nodes)
+
+    def and_expr(self):
+        nodes = [self.not_expr()]
+        while True:
+            if self.keyword('AND'):
+                nodes.append(self.not_expr())
+                continue
+            kind, value = self.peek()
+            # side by side terms are ANDed
+            if kind in ('(', 'quoted') or (kind == 'word' and value.upper() != 'OR'):
+                nodes.append(self.not_expr())
+                continue
+            return _combine('and', nodes)
+
+    def not_expr(self):
+        if self.keyword('NOT'):
+            self.depth += 1
+            if self.depth > MAX_DEPTH:
+                raise ValueError("expression is nested too deeply")
+            node = self.not_expr()
+            self.depth -= 1
+            return node[1] if node[0] == 'not' else ('not', node)
+        return self.atom()
+
+    def atom(self):
+        kind, value = self.peek()
+        if kind == '(':
+            self.pos += 1
+            self.depth += 1
+            if self.depth > MAX_DEPTH:
+                raise ValueError("expression is nested too deeply")
+            node = self.or_expr()
+            self.depth -= 1
+            if self.peek()[0] != ')':
+                raise ValueError("missing ')'")
+            self.pos += 1
+            return node
+        if kind not in ('word', 'quoted'):
+            raise ValueError("expected a term" if kind is None else f"unexpected {kind!r}")
+        if kind == 'word' and value.upper() in ('AND', 'OR'):
+            raise ValueError(f"unexpected {value!r}")
+        self.pos += 1
+        if self.peek()[0] != ':':
+            return ('term', None, value)
+        self.pos += 1
+        field = FIELDS.get(value.lower()) if kind == 'word' else None
+        if field is None:
+            raise ValueError(f"unknown field {value!r}")
+        kind, term = self.peek()
+        if kind not in ('word', 'quoted'):
+            raise ValueError(f"missing value for {value}:")
+        self.pos += 1
+        if field == 'restricted':
+            if term.lower() not in ('true', 'false'):
+                raise ValueError("restricted: must be true or false")
+            term = term.lower()
+        return ('term', field, term)
+
+def _combine(op, nodes):
+    """Flattened, de-duplicated and sorted, so equivalent expressions compare equal."""
+    flat = set()
+    for node in nodes:
+        flat.update(node[1:] if node[0] == op else (node,))
+    if len(flat) == 1:
+        return flat.pop()
+    return (op, *sorted(flat, key=repr))
+
+def parse_query(text):
+    """Canonical expression tree for q; raises ValueError on a syntax error."""
+    if len(text) > MAX_LENGTH:
+        raise ValueError(f"q is longer than {MAX_LENGTH} characters")
+    tokens = _tokens(text)
+    if not tokens:
+        raise ValueError("q is empty")
+    return _Parser(tokens).parse()
+
+def query_text(node):
+    """Canonical text of an expression tree, for ETags and cache keys."""
+    if node[0] == 'term':
+        _, field, value = node
+        value = '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        return f"{field}:{value}" if field else value
+    if node[0] == 'not':
+        return 'NOT ' + query_text(node[1])
+    return '(' + f' {node[0].upper()} '.join(query_text(n) for n in node[1:]) + ')'
+
+def evaluate(node, index):
+    """Bitset of the videos matching an expression tree, from the label index."""
+    op = node[0]
+    if op == 'term':
+        _, field, value = node
+        if field is None:
+            bits = 0
+            for c in LABEL_FIELDS:
+                bits |= index.value_bits(c, value)
+            return bits
+        return index.value_bits(field, value)
+    if op == 'not':
+        return index.all_bits & ~evaluate(node[1], index)
+    if op == 'and':
+        bits = index.all_bits
+        for child in node[1:]:
+            bits &= evaluate(child, index)
+            if not bits:
+                break
+        return bits
+    bits = 0
+    for child in node[1:]:
+        bits |= evaluate(child, index)
+    return bits
@@ -0,0 +1,334 @@
+# backend/serve.py
+"""Production entry point: a pre-fork master running uvicorn workers on one listening socket.
+
+    python main_server.py --workers 4 --http httptools
+    WEB_CONCURRENCY=4 GRACEFUL_TIMEOUT=60 python main_server.py
+    python main_server.py --reload          # development: one process, restarts on code changes
+
+Every flag can also be set through the environment variable in its help.
+
+The master binds the socket and forks the workers. By default each worker
+starts accepting at once and loads the data in the background, answering
+/api/health/ready (and the API) with 503 and its progress meanwhile; a
+worker whose load fails stays up, not ready, until the label file changes
+and its watcher loads it again. Set SHARED_DATASET=1 to have one worker
+build the dataset and the others map it.
+
+With --preload the master loads the dataset before forking, so the workers
+share its pages copy-on-write; connections wait in the socket's backlog
+until it is done. The master then watches the label file itself: a change
+is loaded once, in the master, and the workers are recycled onto it. When
+the master's first load fails, the workers load the data themselves as
+without --preload.
+
+Signals to the master:
+    SIGTERM, SIGINT  workers stop accepting, finish in-flight requests (up to
+                     --graceful-timeout) and exit, then the master exits
+    SIGHUP           replace the workers one at a time; each new worker loads
+                     the data before the one it replaces starts draining, and
+                     when it can't, the recycle stops and the old ones stay
+"""
+import argparse, asyncio, gc, os, select, signal, socket, sys, time, traceback
+import uvicorn
+
+def env_flag(name, default):
+    value = os.getenv(name)
+    return default if value is None else value.lower() not in ("", "0", "false", "no")
+
+def parse_args(argv=None):
+    from main_server import APP_PORT
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"), help="HOST (default 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", APP_PORT)), help=f"PORT (default {APP_PORT})")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")), help="WEB_CONCURRENCY (default 1)")
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"], default=os.getenv("UVICORN_LOOP", "auto"), help="UVICORN_LOOP (default auto)")
+    parser.add_argument("--http", choices=["auto", "h11", "httptools"], default=os.getenv("UVICORN_HTTP", "auto"), help="UVICORN_HTTP (default auto)")
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction, default=env_flag("PRELOAD", False),
+                        help="PRELOAD: load the dataset in the master before forking (default off)")
+    parser.add_argument("--graceful-timeout", type=float, default=float(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="GRACEFUL_TIMEOUT: seconds a stopping worker gets to finish its requests (default 30)")
+    parser.add_argument("--startup-timeout", type=float, default=float(os.getenv("STARTUP_TIMEOUT", "600")),
+                        help="STARTUP_TIMEOUT: seconds a new worker gets to start accepting, or to load the data "
+                             "when it replaces another one (default 600)")
+    parser.add_argument("--reload", action="store_true", help="development server that restarts on code changes")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+class Worker:
+    """A forked worker and the pipe it reports on: b'S' once it accepts connections, b'R' once it
+    serves data, b'F' when loading the data failed (it keeps accepting and answers 503)."""
+
+    def __init__(self, pid, fd):
+        self.pid = pid
+        self.fd = fd
+        self.started = time.monotonic()
+        self.accepting = self.ready = self.failed = False
+
+    def poll(self, timeout=0):
+        """Take in what the worker reported within timeout seconds; False once it closed the pipe."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return True
+        report = os.read(self.fd, 64)
+        if not report:
+            return False
+        self.accepting = True
+        self.failed = self.failed or b'F' in report
+        self.ready = self.ready or b'R' in report
+        return True
+
+class Master:
+    """Forks the uvicorn workers, replaces the ones that die, and handles SIGTERM / SIGHUP."""
+
+    def __init__(self, args, sock, app_module, preloaded=False):
+        self.args = args
+        self.sock = sock
+        self.app_module = app_module
+        self.preloaded = preloaded  # the master holds the dataset and watches the label file
+        self.workers = {}       # pid -> Worker, of the workers currently serving
+        self.retiring = set()   # pids draining after a recycle
+        self.stopping = False
+        self.recycle = False
+
+    def run(self):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._stop)
+        signal.signal(signal.SIGHUP, self._recycle)
+        print(f"Master {os.getpid()} listening on {self.args.host}:{self.args.port}, starting {self.args.workers} workers.")
+        for _ in range(self.args.workers):
+            if self.stopping:
+                break
+            self.start_worker()
+        if self.preloaded:
+            self.watch()
+        else:
+            while not self.stopping:
+                self.tick()
+                time.sleep(0.5)
+        self.shutdown()
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _recycle(self, signum, frame):
+        self.recycle = True
+
+    def watch(self):
+        """Reload the dataset in the master when the label file changes, then recycle the workers."""
+        from watchfiles import watch
+        path, _ = self.app_module.get_json_path()
+        watch_filter = lambda change, changed: os.path.abspath(changed) == os.path.abspath(path)
+        # times out every half second so signals and dead workers are seen to promptly
+        for changes in watch(os.path.dirname(path), watch_filter=watch_filter, rust_timeout=500, yield_on_timeout=True,
+                             raise_interrupt=False):
+            if self.stopping:
+                return
+            if changes:
+                print(f"Label file changed, reloading {path}")
+                generation = self.app_module.dataset.current().generation
+                try:
+                    self.app_module.load_data_into_memory()
+                    self.recycle = self.recycle or self.app_module.dataset.current().generation != generation
+                except Exception as e:
+                    print(f"Reload failed, keeping the current data: {e!r}")
+            self.tick()
+
+    def tick(self):
+        for worker in self.workers.values():
+            worker.poll()
+        self.reap()
+        if self.recycle and not self.stopping:
+            self.recycle = False
+            self.recycle_workers()
+
+    def wait_for(self, worker, condition):
+        """Wait until condition() holds for worker; False when it exits, times out or the master stops first."""
+        deadline = time.monotonic() + self.args.startup_timeout
+        # wait in short steps: a worker loading its data can take minutes, and SIGTERM shouldn't wait for it
+        while not condition():
+            if self.stopping or time.monotonic() > deadline or not worker.poll(0.5):
+                return False
+        return True
+
+    def start_worker(self, load_first=False):
+        """Fork a worker and wait until it accepts; returns it, or None when it didn't come up.
+        With load_first it loads the data before accepting, to take over from workers that serve it."""
+        gc.freeze()  # keep the collector from touching, and so copying, what the workers inherit (modules, preloaded data)
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                for worker in self.workers.values():
+                    os.close(worker.fd)
+                for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                    signal.signal(sig, signal.SIG_DFL)
+                run_worker(self.args, self.sock, self.app_module, ready_w, load_first)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        os.close(ready_w)
+        worker = Worker(pid, ready_r)
+        self.workers[pid] = worker
+        if self.wait_for(worker, lambda: worker.accepting) or self.stopping:
+            return worker  # a worker still starting up when the master stops is stopped with the others
+        print(f"Worker {pid} did not start serving, stopping it.")
+        del self.workers[pid]
+        os.close(worker.fd)
+        self.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        return None
+
+    def retire(self, pid):
+        """Let a worker finish its requests and exit."""
+        os.close(self.workers.pop(pid).fd)
+        self.retiring.add(pid)
+        self.kill(pid, signal.SIGTERM)
+
+    def recycle_workers(self):
+        """Zero-downtime restart: start a replacement, then let the old worker drain, one at a time."""
+        print(f"Recycling {len(self.workers)} workers.")
+        for old in list(self.workers):
+            if self.stopping:
+                return
+            new = self.start_worker(load_first=True)
+            if new is None or not self.wait_for(new, lambda: new.ready or new.failed):
+                if not self.stopping:
+                    print("Recycle aborted, keeping the remaining workers.")
+                return
+            if not new.ready:
+                print(f"Worker {new.pid} could not load the data, recycle aborted, keeping the remaining workers.")
+                self.retire(new.pid)
+                return
+            self.retire(old)
+
+    def reap(self):
+        """Collect exited workers, replacing the ones that died on their own."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            os.close(worker.fd)
+            if self.stopping:
+                continue
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, starting a new one.")
+            if time.monotonic() - worker.started < 1:
+                time.sleep(1)  # don't spin on a worker that crashes at startup
+            # when the others serve data the new one loads it first, so it never takes a request they could answer
+            self.start_worker(load_first=any(w.ready for w in self.workers.values()))
+
+    def kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def shutdown(self):
+        """Graceful stop: SIGTERM every worker, SIGKILL what is still running after the grace period."""
+        pids = set(self.workers) | self.retiring
+        print(f"Stopping {len(pids)} workers.")
+        for pid in pids:
+            self.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while pids and time.monotonic() < deadline:
+            for pid in list(pids):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    pids.discard(pid)
+            time.sleep(0.1)
+        for pid in pids:
+            print(f"Worker {pid} did not finish in time, killing it.")
+            self.kill(pid, signal.SIGKILL)
+        print("Master stopped.")
+
+def run_worker(args, sock, app_module, ready_fd, load_first=False):
+    """Serve app_module.app on the inherited socket until SIGTERM, reporting on ready_fd (see Worker).
+    With load_first the data is loaded before accepting; if that fails the worker accepts anyway, not ready."""
+    def report(status):
+        try:
+            os.write(ready_fd, status)
+        except BrokenPipeError:
+            pass  # retired by the master, which no longer listens
+
+    class Server(uvicorn.Server):
+        async def startup(self, sockets=None):
+            await super().startup(sockets=sockets)
+            if not self.should_exit:
+                report(b'S')
+                self.reporter = asyncio.create_task(self.report_load())
+
+        async def report_load(self):
+            # the data loads in the background (see main_server.startup_event), and again
+            # when the label file changes after a failed load
+            failed = False
+            while not self.should_exit:
+                if app_module.dataset.current().generation != 0:
+                    report(b'R')
+                    return
+                if app_module.load_progress.phase == 'failed' and not failed:
+                    failed = True
+                    report(b'F')
+                await asyncio.sleep(0.1)
+
+    if load_first and app_module.dataset.current().generation == 0:
+        try:
+            app_module.load_data_into_memory()
+        except Exception as e:
+            app_module.load_progress.failed(e)
+            traceback.print_exc()
+    config = uvicorn.Config(app_module.app, loop=args.loop, http=args.http, lifespan="on",
+                            timeout_graceful_shutdown=args.graceful_timeout)
+    Server(config).run(sockets=[sock])
+
+def preload(app_module):
+    """Load the dataset in the master, before any worker is forked; False when that failed."""
+    try:
+        app_module.load_data_into_memory()
+    except Exception:
+        traceback.print_exc()
+        print("Preloading failed, the workers load the data themselves.")
+        app_module.load_progress.start()  # so they load it at startup rather than wait for the file to change
+        return False
+    # the master watches the label file and recycles the workers, so they don't watch it themselves
+    app_module.WATCH_LABEL_FILE = False
+    return True
+
+def main(argv=None):
+    # master and workers write to the same stdout, keep their lines whole and in order
+    sys.stdout.reconfigure(line_buffering=True)
+    args = parse_args(argv)
+    if args.reload:
+        uvicorn.run("main_server:app", host=args.host, port=args.port, reload=True)
+        return
+    if not hasattr(os, "fork"):
+        # no pre-fork master on Windows, uvicorn's own supervisor spawns the workers instead
+        uvicorn.run("main_server:app", host=args.host, port=args.port, workers=args.workers, loop=args.loop, http=args.http,
+                    timeout_graceful_shutdown=args.graceful_timeout)
+        return
+    sock = socket.create_server((args.host, args.port), backlog=2048)
+    sock.set_inheritable(True)
+    import main_server
+    if args.preload and main_server.QUERY_SHARDS and main_server.FILTER_ENGINE in main_server.QUERY_SHARD_ENGINES:
+        sys.exit("QUERY_SHARDS can't be combined with --preload: forked workers can't share the shard pool.")
+    Master(args, sock, main_server, args.preload and preload(main_server)).run()
+
+if __name__ == "__main__":
+    main()
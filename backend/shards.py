@@ -0,0 +1,147 @@
+# backend/shards.py
+import multiprocessing, threading
+from array import array
+from bisect import bisect_left
+from snapshot import load_snapshot
+from sorting import query_rows, parse_dt, to_epoch
+
+def shard_bounds(n, shards):
+    """[lo, hi) row ranges splitting n rows into at most shards contiguous, near-equal shards."""
+    shards = max(1, min(shards, n))
+    return [(n * i // shards, n * (i + 1) // shards) for i in range(shards)]
+
+def _serve(conn, snap, key, lo, hi, engine):
+    """Worker process: map the snapshot, index rows [lo, hi) and answer queries until told to stop."""
+    data = load_snapshot(snap, key, lambda other: {})
+    if data is None:
+        conn.send(('error', f"snapshot {snap} is missing or stale"))
+        return
+    store = data['store'].slice(lo, hi)
+    shard = {'store': store, 'video_labels': store.view(), 'index': data['index'].cut(store, lo, hi)}
+    del data  # the whole-store bitsets aren't needed once the shard is cut out
+    if engine == 'numpy':
+        from numpy_engine import NumpyIndex
+        shard['numpy_index'] = NumpyIndex(store)
+    conn.send(('ready', None))
+    while True:
+        request = conn.recv()
+        if request is None:
+            return
+        engine, args = request
+        try:
+            rows, facets = query_rows(shard, engine, *args)
+            conn.send(('ok', (array('I', (lo + i for i in rows)).tobytes(), facets)))
+        except Exception as e:
+            conn.send(('error', repr(e)))
+
+class ShardPool:
+    """Worker processes that each hold one contiguous, date-ordered shard of the dataset.
+
+    Workers map the same snapshot file, so the store columns live once in
+    the page cache and are shared between them; each builds only its own
+    shard's bitsets. A query goes to the shards overlapping its date window,
+    runs in parallel outside the server's GIL, and the per-shard rows are
+    concatenated in shard order, which keeps them in date order.
+    """
+
+    def __init__(self, bounds, starts, ends, workers):
+        self.bounds = bounds
+        self.starts = starts  # epoch time of each shard's first row
+        self.ends = ends      # and of its last
+        self.workers = workers  # (process, connection, lock) per shard
+        self.closed = False
+
+    @classmethod
+    def start(cls, snap, key, store, shards, engine):
+        """Start one worker per shard of store (as saved in snap); None when a worker fails to start."""
+        if not len(store):
+            return None
+        ctx = multiprocessing.get_context('spawn')  # forking a threaded server is unsafe
+        bounds = shard_bounds(len(store), shards)
+        workers = []
+        for lo, hi in bounds:
+            conn, child = ctx.Pipe()
+            process = ctx.Process(target=_serve, args=(child, snap, key, lo, hi, engine), daemon=True)
+            process.start()
+            child.close()
+            workers.append((process, conn, threading.Lock()))
+        pool = cls(bounds, [store.times[lo] for lo, _ in bounds], [store.times[hi - 1] for _, hi in bounds], workers)
+        for process, conn, _ in workers:
+            try:
+                status, detail = conn.recv()
+            except EOFError:
+                process.join(1)
+                status, detail = 'error', f"worker exited with code {process.exitcode}"
+            if status != 'ready':
+                print(f"Could not start query shards: {detail}")
+                pool.close()
+                return None
+        return pool
+
+    def overlapping(self, start, end):
+        """[lo, hi) range of the shards with rows between epoch times start and end."""
+        return bisect_left(self.ends, start), bisect_left(self.starts, end + 1)
+
+    def query(self, engine, sites, animals, actions, add_labels, date_labels, restricted, query=None):
+        """Row ids (in date order) and facet counts merged from the shards, or None once the pool is closed.
+
+        A worker that has died closes the pool, so this and later queries fall back to filtering in process.
+        """
+        start, end = to_epoch(parse_dt(date_labels[0])), to_epoch(parse_dt(date_labels[1]))
+        args = (sites, animals, actions, add_labels, date_labels, restricted, query)
+        lo, hi = self.overlapping(start, end)
+        scanned = self.workers[lo:hi]
+        lost = None
+        # one request per worker at a time; taking the locks in shard order can't deadlock
+        for _, _, lock in scanned:
+            lock.acquire()
+        try:
+            if self.closed:
+                return None
+            try:
+                for _, conn, _ in scanned:
+                    conn.send((engine, args))
+                replies = [conn.recv() for _, conn, _ in scanned]
+            except (EOFError, OSError) as e:
+                lost = e
+        finally:
+            for _, _, lock in scanned:
+                lock.release()
+        if lost is not None:
+            print(f"Lost a query shard worker ({lost!r}), filtering in process from now on.")
+            self.close()
+            return None
+        rows = array('I')
+        facets = {'sites': {}, 'animals': {}, 'actions': {}, 'add_labels': {}}
+        for status, result in replies:
+            if status != 'ok':
+                raise RuntimeError(f"query shard failed: {result}")
+            shard_rows, shard_facets = result
+            rows.frombytes(shard_rows)
+            for name, counts in shard_facets.items():
+                merged = facets[name]
+                for value, count in counts.items():
+                    merged[value] = merged.get(value, 0) + count
+        return rows, facets
+
+    def close(self):
+        """Stop the workers, after any query they are answering."""
+        for _, _, lock in self.workers:
+            lock.acquire()
+        try:
+            if self.closed:
+                return
+            self.closed = True
+            for process, conn, _ in self.workers:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                conn.close()
+            for process, _, _ in self.workers:
+                process.join(5)
+                if process.is_alive():
+                    process.terminate()
+        finally:
+            for _, _, lock in self.workers:
+                lock.release()
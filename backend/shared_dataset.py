@@ -0,0 +1,90 @@
+# backend/shared_dataset.py
+"""One copy of the dataset for all uvicorn workers (SHARED_DATASET=1).
+
+The first worker to need a version of the label JSON builds it into a
+segment file next to the JSON, <name>.<sha256 prefix>.snapshot, while
+holding an exclusive lock; the others wait for it and then map the same
+segment read-only. Store columns and video keys stay in the mapping, so
+they are in memory once however many workers there are.
+
+Each worker holds a shared lock on the segment it serves from. A segment
+nobody holds any more is deleted when a newer one is attached.
+"""
+import os, glob
+from snapshot import load_snapshot, save_snapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows, which has no flock
+    fcntl = None
+
+def segment_path(json_path, key):
+    return f"{os.path.splitext(json_path)[0]}.{key['sha256'][:16]}.snapshot"
+
+class Segment:
+    """Shared lock on one segment file, held while a generation is served from it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+
+    def release(self):
+        """Let the segment be retired; the mapping itself stays valid until it is garbage collected."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+def attach(json_path, key, build, elevations_of):
+    """Map the segment for key, building it first when no worker has yet.
+
+    build() returns (data, info) for a new segment, info being the JSON the
+    other workers get back as data['snapshot_info']. Returns the mapped data
+    dict, holding its Segment under 'segment', and whether this call built it.
+    """
+    if fcntl is None:
+        raise RuntimeError("SHARED_DATASET needs POSIX file locks")
+    path = segment_path(json_path, key)
+    with open(os.path.splitext(json_path)[0] + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            data = load_snapshot(path, key, elevations_of, mapped_keys=True)
+            built = data is None
+            if built:
+                new, info = build()
+                save_snapshot(path, new, key, info, key_table=True)
+                del new  # served from the mapping from now on, like everyone else
+                data = load_snapshot(path, key, elevations_of, mapped_keys=True)
+            data['segment'] = Segment(path)
+            retire_segments(json_path, path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return data, built
+
+def retire(json_path, current):
+    """retire_segments under the lock, e.g. after releasing the segment of an older generation."""
+    with open(os.path.splitext(json_path)[0] + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            retire_segments(json_path, current)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def retire_segments(json_path, current):
+    """Delete the segments of json_path other than current that no worker holds."""
+    for path in glob.glob(glob.escape(os.path.splitext(json_path)[0]) + '.*.snapshot'):
+        if path == current:
+            continue
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            continue  # still served from
+        else:
+            os.remove(path)
+            print(f"Retired dataset segment {path}")
+        finally:
+            os.close(fd)
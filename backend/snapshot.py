@@ -0,0 +1,195 @@
+# backend/snapshot.py
+import os, json, mmap, hashlib, struct, threading
+from array import array
+from itertools import accumulate
+from label_index import LabelIndex
+from label_store import LabelStore, MappedKeys, MappedKeyIds, CATEGORIES
+
+MAGIC = b'GCSNAP02'
+HEADER = struct.Struct('<8sQQ')  # magic, offset and length of the JSON meta block at the end
+ALIGN = 8
+DERIVED = ('video_labels', 'store', 'index', 'partitions', 'numpy_index', 'shards', 'snapshot_info', 'segment')  # rebuilt on load, not JSON
+
+def snapshot_path(json_path):
+    return os.path.splitext(json_path)[0] + '.snapshot'
+
+def file_sha256(path, chunk=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(chunk)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def snapshot_key(json_path, root):
+    """Identity of the source JSON (and of the path conversion applied to it)."""
+    st = os.stat(json_path)
+    return {
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'sha256': file_sha256(json_path),
+        'root': root,
+    }
+
+def _typecode(col):
+    # arrays when built from JSON, memoryviews when mapped from a snapshot
+    return getattr(col, 'typecode', None) or col.format
+
+def _bits_bytes(bits, n):
+    return bits.to_bytes((n + 7) // 8, 'little')
+
+def save_snapshot(path, data, key, info=None, key_table=False):
+    """Write the processed dataset (store columns, index bitsets, other JSON parts) to path.
+
+    info is any JSON value to keep alongside (load_snapshot returns it as
+    'snapshot_info'). key_table adds the hash table MappedKeyIds needs to look
+    keys up without decoding them all.
+    """
+    store, index = data['store'], data['index']
+    n = len(store)
+    sections = []
+    # a temp file per writer: the workers of a server may all be writing the same snapshot
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, 0, 0))  # rewritten once the meta block is written
+
+            # each section goes to the file as soon as it is encoded, so only one is in memory at a time
+            def add(name, blob, typecode=None):
+                add_chunks(name, (blob,), typecode)
+
+            def add_chunks(name, chunks, typecode=None):
+                offset = f.tell() - HEADER.size
+                for chunk in chunks:
+                    f.write(chunk)
+                length = f.tell() - HEADER.size - offset
+                f.write(b'\0' * (-length % ALIGN))
+                sections.append({'name': name, 'offset': offset, 'length': length, 'typecode': typecode})
+
+            key_offsets = array('Q', [0])
+
+            def key_chunks(batch=4096):
+                # NUL-separated keys, a few thousand at a time; each key's end goes to key_offsets
+                for lo in range(0, n, batch):
+                    encoded = [k.encode('utf-8', 'surrogatepass') for k in store.keys[lo:lo + batch]]
+                    start = key_offsets[-1]
+                    key_offsets.extend(start + end for end in accumulate(len(k) + 1 for k in encoded))
+                    yield (b'\0' if lo else b'') + b'\0'.join(encoded)
+
+            add_chunks('keys', key_chunks())
+            add('keys.offsets', key_offsets.tobytes(), 'Q')
+            if key_table:
+                add('keys.table', MappedKeyIds.build_table(store.keys).tobytes(), 'I')
+            for name in ('site_ids', 'times', 'time_fmt', 'flags'):
+                col = getattr(store, name)
+                add(name, col.tobytes(), _typecode(col))
+            for c in CATEGORIES:
+                offsets, ids = store.label_columns[c]
+                add(c + '.offsets', offsets.tobytes(), _typecode(offsets))
+                add(c + '.ids', ids.tobytes(), _typecode(ids))
+
+            site_bits = list(index.sites.items())
+            for i, (_, bits) in enumerate(site_bits):
+                add(f'index.sites.{i}', _bits_bytes(bits, n))
+            label_bits = {c: list(index.values[c].items()) for c in CATEGORIES}
+            for c in CATEGORIES:
+                for i, (_, bits) in enumerate(label_bits[c]):
+                    add(f'index.{c}.{i}', _bits_bytes(bits, n))
+                add(f'index.{c}.empty', _bits_bytes(index.empty[c], n))
+            add('index.restricted', _bits_bytes(index.restricted, n))
+
+            meta = {
+                'key': key,
+                'n': n,
+                'sections': sections,
+                'site_vocab': store.site_vocab,
+                'label_vocab': store.label_vocab,
+                'extras': {str(i): e for i, e in store.extras.items()},
+                'index_sites': [s for s, _ in site_bits],
+                'index_values': {c: [v for v, _ in label_bits[c]] for c in CATEGORIES},
+                'other': {k: v for k, v in data.items() if k not in DERIVED},
+                'info': info,
+            }
+            meta_blob = json.dumps(meta).encode('utf-8')
+            meta_offset = f.tell()
+            f.write(meta_blob)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, meta_offset, len(meta_blob)))
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+def _read_meta(f):
+    """The meta block of an open snapshot file, or None when it isn't in this format."""
+    magic, meta_offset, meta_len = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        return None
+    f.seek(meta_offset)
+    return json.loads(f.read(meta_len))
+
+def snapshot_matches(path, key):
+    """True when path holds a snapshot written for key."""
+    try:
+        with open(path, 'rb') as f:
+            meta = _read_meta(f)
+    except FileNotFoundError:
+        return False
+    return meta is not None and meta['key'] == key
+
+def load_snapshot(path, key, elevations_of, mapped_keys=False):
+    """Map a snapshot written for key; returns the data dict, or None when missing or stale.
+
+    Column arrays are memoryviews straight into the mapping, so nothing is
+    copied until a page is touched. With mapped_keys the video keys stay in the
+    mapping too (see MappedKeys) instead of becoming a list of strings.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        meta = _read_meta(f)
+        if meta is None or meta['key'] != key:
+            return None
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    base = HEADER.size
+    buf = memoryview(mm)
+    sections = {}
+    for s in meta['sections']:
+        view = buf[base + s['offset']:base + s['offset'] + s['length']]
+        sections[s['name']] = view.cast(s['typecode']) if s['typecode'] else view
+
+    n = meta['n']
+    if mapped_keys and 'keys.offsets' in sections:
+        keys = MappedKeys(sections['keys'], sections['keys.offsets'])
+    else:
+        keys = bytes(sections['keys']).decode('utf-8', 'surrogatepass').split('\0') if n else []
+    other = meta['other']
+    store = LabelStore(
+        keys, meta['site_vocab'], sections['site_ids'], meta['label_vocab'],
+        {c: (sections[c + '.offsets'], sections[c + '.ids']) for c in CATEGORIES},
+        sections['times'], sections['time_fmt'], sections['flags'],
+        {int(i): e for i, e in meta['extras'].items()},
+        elevations_of(other),
+    )
+    if isinstance(keys, MappedKeys) and 'keys.table' in sections:
+        store.key_ids = MappedKeyIds(keys, sections['keys.table'])
+
+    def bits(name):
+        return int.from_bytes(sections[name], 'little')
+
+    index = LabelIndex(
+        store,
+        {s: bits(f'index.sites.{i}') for i, s in enumerate(meta['index_sites'])},
+        {c: {v: bits(f'index.{c}.{i}') for i, v in enumerate(meta['index_values'][c])} for c in CATEGORIES},
+        {c: bits(f'index.{c}.empty') for c in CATEGORIES},
+        bits('index.restricted'),
+    )
+    return dict(other, video_labels=store.view(), store=store, index=index, snapshot_info=meta.get('info'))
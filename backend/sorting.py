@@ -1,6 +1,11 @@
 # backend/sorting.py
-import os, json
+import os, json, calendar
+from array import array
 from datetime import datetime, timedelta
+from label_index import bits_from_positions
+from query_dsl import evaluate
+
+EPOCH = datetime(1970, 1, 1)
 
 def parse_dt(x):
     if isinstance(x, datetime):
@@ -11,21 +16,197 @@ def parse_dt(x):
         return datetime.strptime(x, "%Y-%m-%d")
     return datetime.fromtimestamp(float(x))
 
+def to_epoch(x):
+    """Seconds since 1970-01-01 for the naive datetime parse_dt(x) gives."""
+    return calendar.timegm(parse_dt(x).timetuple())
+
+def from_epoch(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
 def sort_video_labels_by_date(data):
     items = list(data['video_labels'].items())
-    items.sort(key=lambda kv: parse_dt(kv[1]['time']))
+    items.sort(key=lambda kv: to_epoch(kv[1]['time']))
     data['video_labels'] = dict(items)
     return data
 
+def convert_path(video, root):
+    """Convert one video path to linux format with appropriate root."""
+    return root + '/' + video[video.index('Game cams'):].replace('\\', '/')
+
 def convert_video_labels(data, root):
     """Convert video labels to linux format with appropriate root."""
     video_keys = list(data['video_labels'].keys())
     for video in video_keys:
-        new_video = root + '/' + video[video.index('Game cams'):].replace('\\', '/')
+        new_video = convert_path(video, root)
         data['video_labels'][new_video] = data['video_labels'].pop(video)
     return data
 
-def resort_all_data(data, sites, animals, actions, add_labels, date_labels, restricted):
+FILTER_ENGINES = ('bitmap', 'numpy', 'scan')
+
+def resort_all_data(data, sites, animals, actions, add_labels, date_labels, restricted, engine='bitmap'):
+    """Filter videos using the index for engine built at load time (falls back to a full scan)."""
+    if data.get('sqlite') is not None:
+        return data['sqlite'].keys_of(match_rows_sqlite(data, sites, animals, actions, add_labels, date_labels, restricted))
+    if engine == 'numpy' and data.get('numpy_index') is not None:
+        rows = match_rows_numpy(data, sites, animals, actions, add_labels, date_labels, restricted)
+        keys = data['store'].keys
+        return [keys[i] for i in rows]
+    if engine == 'scan' or data.get('index') is None:
+        return scan_all_data(data, sites, animals, actions, add_labels, date_labels, restricted)
+    bits = match_all_data(data, sites, animals, actions, add_labels, date_labels, restricted)
+    return data['index'].keys_of(bits)
+
+def query_rows(data, engine, sites, animals, actions, add_labels, date_labels, restricted, query=None):
+    """Matching row ids (in date order) and facet counts, evaluated by engine (see FILTER_ENGINES).
+
+    A q expression is always evaluated on the bitmap index and ANDed with the engine's result.
+    With LABEL_BACKEND=sqlite everything runs as SQL and engine is ignored. With QUERY_SHARDS
+    set (for the engines in QUERY_SHARD_ENGINES), the query runs in the shard worker processes
+    (data['shards'], see shards.ShardPool).
+    """
+    if data.get('sqlite') is not None:
+        if not sites or not animals or not actions or not add_labels:
+            return array('I'), {'sites': {}, 'animals': {}, 'actions': {}, 'add_labels': {}}
+        args = _sqlite_args(sites, animals, actions, add_labels, date_labels, restricted)
+        return data['sqlite'].match(*args, query), data['sqlite'].facets(*args, query)
+    shards = data.get('shards')
+    if shards is not None:
+        partitions = data.get('partitions')
+        # a window the monthly partitions can narrow down is cheaper here than a round trip to the workers
+        if engine != 'bitmap' or not partitions or partitions.pruned(to_epoch(parse_dt(date_labels[0])), to_epoch(parse_dt(date_labels[1]))) is None:
+            result = shards.query(engine, sites, animals, actions, add_labels, date_labels, restricted, query)
+            if result is not None:
+                return result
+    if engine == 'numpy':
+        numpy_index = data['numpy_index']
+        rows = match_rows_numpy(data, sites, animals, actions, add_labels, date_labels, restricted)
+        if query is not None and rows:
+            rows = numpy_index.select(rows, evaluate(query, data['index']))
+        return rows, numpy_index.facets(rows)
+    if engine == 'scan':
+        key_ids = data['store'].key_ids
+        keys = scan_all_data(data, sites, animals, actions, add_labels, date_labels, restricted)
+        bits = bits_from_positions([key_ids[k] for k in keys], len(key_ids))
+        if query is not None and bits:
+            bits &= evaluate(query, data['index'])
+    else:
+        partitions = data.get('partitions')
+        scanned = partitions.pruned(to_epoch(parse_dt(date_labels[0])), to_epoch(parse_dt(date_labels[1]))) if partitions else None
+        if scanned is not None:
+            return match_partitions(data, scanned, sites, animals, actions, add_labels, date_labels, restricted, query)
+        bits = match_all_data(data, sites, animals, actions, add_labels, date_labels, restricted, query)
+    return data['index'].rows_of(bits), facet_counts(data, bits)
+
+def match_partitions(data, scanned, sites, animals, actions, add_labels, date_labels, restricted, query=None):
+    """Row ids and facet counts from the scanned monthly partitions only (requires data['partitions'])."""
+    if not sites or not animals or not actions or not add_labels:
+        return array('I'), {'sites': {}, 'animals': {}, 'actions': {}, 'add_labels': {}}
+    start, end = to_epoch(parse_dt(date_labels[0])), to_epoch(parse_dt(date_labels[1]))
+    return data['partitions'].query(scanned, set(sites), set(animals), set(actions), set(add_labels), restricted, start, end, query)
+
+def _sqlite_args(sites, animals, actions, add_labels, date_labels, restricted):
+    start, end = to_epoch(parse_dt(date_labels[0])), to_epoch(parse_dt(date_labels[1]))
+    return set(sites), set(animals), set(actions), set(add_labels), restricted, start, end
+
+def match_rows_sqlite(data, sites, animals, actions, add_labels, date_labels, restricted, query=None):
+    """Same filter as resort_all_data, as row ids from the SQLite backend (requires data['sqlite'])."""
+    if not sites or not animals or not actions or not add_labels:
+        return array('I')
+    return data['sqlite'].match(*_sqlite_args(sites, animals, actions, add_labels, date_labels, restricted), query)
+
+def explain_sqlite(data, sites, animals, actions, add_labels, date_labels, restricted, query=None):
+    """SQLite's query plan for this filter (requires data['sqlite'])."""
+    args = _sqlite_args(sites or (), animals or (), actions or (), add_labels or (), date_labels, restricted)
+    return data['sqlite'].explain(*args, query)
+
+def match_rows_numpy(data, sites, animals, actions, add_labels, date_labels, restricted):
+    """Same filter as resort_all_data, as an array of row ids from the NumPy engine (requires data['numpy_index'])."""
+    index = data['numpy_index']
+    start_date = parse_dt(date_labels[0])
+    end_date = parse_dt(date_labels[1])
+    if not sites or not animals or not actions or not add_labels:
+        return array('I')
+
+    lo, hi = index.date_range(to_epoch(start_date), to_epoch(end_date))
+    return index.match(set(sites), set(animals), set(actions), set(add_labels), restricted, lo, hi)
+
+def match_all_data(data, sites, animals, actions, add_labels, date_labels, restricted, query=None):
+    """Same filter as resort_all_data, returned as an index bitset (requires data['index']).
+
+    query is an optional query_dsl expression tree, ANDed with the other filters.
+    """
+    index = data['index']
+    start_date = parse_dt(date_labels[0])
+    end_date = parse_dt(date_labels[1])
+    if not sites or not animals or not actions or not add_labels:
+        return 0
+
+    lo, hi = index.date_range(to_epoch(start_date), to_epoch(end_date))
+    bits = index.match(set(sites), set(animals), set(actions), set(add_labels), restricted, lo, hi)
+    if query is not None and bits:
+        bits &= evaluate(query, index)
+    return bits
+
+def plan_all_data(data, sites, animals, actions, add_labels, date_labels, restricted):
+    """The index's evaluation plan for this filter, as used by match_all_data (requires data['index'])."""
+    index = data['index']
+    lo, hi = index.date_range(to_epoch(parse_dt(date_labels[0])), to_epoch(parse_dt(date_labels[1])))
+    return index.plan(set(sites or ()), set(animals or ()), set(actions or ()), set(add_labels or ()), restricted, lo, hi)
+
+def explain_query(data, engine, sites, animals, actions, add_labels, date_labels, restricted, query=None):
+    """How query_rows evaluates this filter (debug=plan), following the same route it takes.
+
+    SQL for the SQLite backend; the shards queried when they run it; with the
+    bitmap engine, the monthly partitions scanned and each one's plan, or the
+    plan over the whole index. The numpy and scan engines have no plan to show.
+    """
+    skipped = 'nothing selected in one of the filter categories' if not sites or not animals or not actions or not add_labels else None
+    if data.get('sqlite') is not None:
+        if skipped:
+            return {'engine': 'sqlite', 'skipped': skipped}
+        return {'engine': 'sqlite', 'sql': explain_sqlite(data, sites, animals, actions, add_labels, date_labels, restricted, query)}
+    plan = {'engine': engine}
+    if query is not None:
+        plan['query'] = 'evaluated on the bitmap index and ANDed with the result'
+    start, end = to_epoch(parse_dt(date_labels[0])), to_epoch(parse_dt(date_labels[1]))
+    partitions = data.get('partitions')
+    scanned = partitions.pruned(start, end) if engine == 'bitmap' and partitions else None
+    shards = data.get('shards')
+    if shards is not None and not shards.closed and scanned is None:
+        lo, hi = shards.overlapping(start, end)
+        plan['shards'] = {'queried': [list(b) for b in shards.bounds[lo:hi]], 'total': len(shards.bounds)}
+        return plan
+    if skipped:
+        plan['skipped'] = skipped
+        return plan
+    if engine != 'bitmap':
+        return plan
+    wanted = set(sites), set(animals), set(actions), set(add_labels)
+    if scanned is not None:
+        steps = []
+        for p in scanned:
+            lo, hi = p.index.date_range(start, end)
+            steps.append(dict(month=p.month, **p.index.plan(*wanted, restricted, lo, hi).describe()))
+        plan['partitions'] = {'scanned': steps, 'total': len(partitions.partitions)}
+        return plan
+    plan.update(plan_all_data(data, sites, animals, actions, add_labels, date_labels, restricted).describe())
+    if partitions:
+        plan['partitions'] = {'scanned': 'all (whole-store index)', 'total': len(partitions.partitions)}
+    return plan
+
+def preview_all_data(data, sites, animals, actions, add_labels, date_labels, restricted, query=None):
+    """Current match count plus the count after toggling each filter value (requires data['index'])."""
+    index = data['index']
+    lo, hi = index.date_range(to_epoch(parse_dt(date_labels[0])), to_epoch(parse_dt(date_labels[1])))
+    within = evaluate(query, index) if query is not None else None
+    return index.preview(sites or (), animals or (), actions or (), add_labels or (), restricted, lo, hi, within)
+
+def facet_counts(data, bits):
+    """Per-value counts of the videos in bits; the index-backed counterpart of reverse_subset."""
+    return data['index'].facets(bits)
+
+def scan_all_data(data, sites, animals, actions, add_labels, date_labels, restricted):
+    """Reference linear scan over every video; used when no index is available."""
     videos = []
     video_labels = data['video_labels']
     start_date = parse_dt(date_labels[0])
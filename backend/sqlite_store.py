@@ -0,0 +1,321 @@
+# backend/sqlite_store.py
+import os, glob, json, sqlite3, threading
+from array import array
+from collections.abc import Mapping
+from json_stream import load_streaming
+from label_store import CATEGORIES, Interner, parse_time
+
+CATEGORY_IDS = {c: i for i, c in enumerate(CATEGORIES)}
+BATCH = 10_000
+MAX_PARAMS = 900  # ids per IN (...) when fetching rows
+
+# Videos are numbered in date order (ties in file order), like the rows of a LabelStore
+SCHEMA = """
+CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE sites (id INTEGER PRIMARY KEY, name UNIQUE);
+CREATE TABLE labels (id INTEGER PRIMARY KEY, name UNIQUE);
+CREATE TABLE videos (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    site_id INTEGER REFERENCES sites(id),
+    time INTEGER NOT NULL,
+    restricted INTEGER NOT NULL,
+    labels TEXT NOT NULL
+);
+CREATE TABLE video_labels (
+    video_id INTEGER NOT NULL REFERENCES videos(id),
+    category INTEGER NOT NULL,
+    label_id INTEGER NOT NULL REFERENCES labels(id),
+    PRIMARY KEY (video_id, category, label_id)
+) WITHOUT ROWID;
+"""
+INDEXES = """
+CREATE INDEX videos_time ON videos(time);
+CREATE INDEX videos_site_time ON videos(site_id, time);
+CREATE INDEX video_labels_label ON video_labels(category, label_id, video_id);
+"""
+
+def database_path(json_path, key):
+    """Database file next to the JSON, named after the content it was built from."""
+    return f"{os.path.splitext(json_path)[0]}.{key['sha256'][:16]}.sqlite"
+
+def remove_stale_databases(json_path, keep):
+    """Delete databases built from older versions of json_path, except the paths in keep."""
+    for path in glob.glob(glob.escape(os.path.splitext(json_path)[0]) + '.*.sqlite'):
+        if path not in keep:
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+
+def build_database(json_path, db_path, key, convert_key=None):
+    """Stream the label JSON into a new SQLite database at db_path (written aside, then renamed)."""
+    tmp = db_path + '.tmp'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(tmp + suffix):
+            os.remove(tmp + suffix)
+    conn = sqlite3.connect(tmp)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")  # a failed build is thrown away anyway
+    conn.executescript(SCHEMA)
+    conn.execute("CREATE TEMP TABLE raw (seq INTEGER PRIMARY KEY, path TEXT, site_id INTEGER, time INTEGER, restricted INTEGER, labels TEXT)")
+    conn.execute("CREATE TEMP TABLE raw_labels (seq INTEGER, category INTEGER, label_id INTEGER)")
+    sites, labels = Interner(), Interner()
+    videos, video_labels = [], []
+
+    def flush():
+        conn.executemany("INSERT INTO raw VALUES (?, ?, ?, ?, ?, ?)", videos)
+        conn.executemany("INSERT INTO raw_labels VALUES (?, ?, ?)", video_labels)
+        videos.clear()
+        video_labels.clear()
+
+    def add(path, row):
+        seq = add.count
+        add.count += 1
+        site = row.get('site')
+        try:
+            site_id = sites(site) if site is not None else None
+        except TypeError:  # unhashable, kept in the JSON but never matched
+            site_id = None
+        epoch, _ = parse_time(row['time'])
+        restricted = 1 if row.get('restricted', False) else 0
+        videos.append((seq, convert_key(path) if convert_key else path, site_id, epoch, restricted,
+                       json.dumps(row, ensure_ascii=False)))
+        for c, cid in CATEGORY_IDS.items():
+            values = row.get(c)
+            if isinstance(values, list):
+                for value in values:
+                    try:
+                        video_labels.append((seq, cid, labels(value)))
+                    except TypeError:
+                        pass
+        if len(videos) >= BATCH:
+            flush()
+    add.count = 0
+
+    with open(json_path, 'r') as f:
+        other = load_streaming(f, add)
+    flush()
+    # number the videos in date order; a repeated path keeps its last entry, like a dict would
+    conn.execute("""CREATE TEMP TABLE ids AS
+        SELECT seq, ROW_NUMBER() OVER (ORDER BY time, seq) - 1 AS id FROM raw
+        WHERE seq IN (SELECT MAX(seq) FROM raw GROUP BY path)""")
+    conn.execute("""INSERT INTO videos SELECT ids.id, path, site_id, time, restricted, labels
+        FROM raw JOIN ids USING (seq) ORDER BY ids.id""")
+    conn.execute("INSERT OR IGNORE INTO video_labels SELECT ids.id, category, label_id FROM raw_labels JOIN ids USING (seq)")
+    conn.executemany("INSERT INTO sites VALUES (?, ?)", enumerate(sites.values))
+    conn.executemany("INSERT INTO labels VALUES (?, ?)", enumerate(labels.values))
+    conn.executescript("DROP TABLE raw; DROP TABLE raw_labels; DROP TABLE ids;")
+    conn.executescript(INDEXES)
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", [('key', json.dumps(key)), ('other', json.dumps(other))])
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    os.replace(tmp, db_path)
+
+class SQLiteLabels:
+    """Label data served from a SQLite database instead of memory.
+
+    Offers the parts of the LabelStore interface the payload encoders use
+    (len, items, view) plus SQL versions of the filter and facet queries.
+    Each thread gets its own read-only connection.
+    """
+
+    # Labels on at most this fraction of the videos are looked up first,
+    # others are checked per video after the site and date index
+    DRIVE_FRACTION = 0.05
+
+    def __init__(self, path, elevations):
+        self.path = path
+        self.elevations = elevations
+        self._local = threading.local()
+        conn = self._conn()
+        self.site_ids = {name: i for i, name in conn.execute("SELECT id, name FROM sites")}
+        self.site_names = {i: name for name, i in self.site_ids.items()}
+        self.label_ids = {name: i for i, name in conn.execute("SELECT id, name FROM labels")}
+        self.label_names = {i: name for name, i in self.label_ids.items()}
+        self.label_counts = {cid: {} for cid in CATEGORY_IDS.values()}
+        for cid, label_id, count in conn.execute("SELECT category, label_id, COUNT(*) FROM video_labels GROUP BY category, label_id"):
+            self.label_counts[cid][label_id] = count
+        self.n = conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+
+    @classmethod
+    def open(cls, path, key, elevations_of):
+        """(SQLiteLabels, other top-level JSON parts) for a database built for key, or None when missing or stale."""
+        if not os.path.exists(path):
+            return None
+        conn = sqlite3.connect(path)
+        try:
+            meta = dict(conn.execute("SELECT name, value FROM meta"))
+        except sqlite3.DatabaseError:
+            return None
+        finally:
+            conn.close()
+        if json.loads(meta.get('key', 'null')) != key:
+            return None
+        other = json.loads(meta['other'])
+        return cls(path, elevations_of(other)), other
+
+    def _conn(self):
+        pid, conn = getattr(self._local, 'conn', (None, None))
+        # a connection must not be used across fork (see serve.py), open a new one in the child
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = (os.getpid(), conn)
+        return conn
+
+    def __len__(self):
+        return self.n
+
+    def _row(self, labels_json):
+        labels = json.loads(labels_json)
+        site = labels.get('site')
+        if isinstance(site, str) and site in self.elevations:
+            labels['elevation'] = self.elevations[site]
+        return labels
+
+    def items(self, rows):
+        """(path, label dict) for each video id in rows (ascending), in that order."""
+        conn = self._conn()
+        if isinstance(rows, range) and rows.step == 1:
+            cursor = conn.execute("SELECT path, labels FROM videos WHERE id >= ? AND id < ? ORDER BY id", (rows.start, rows.stop))
+            for path, labels in cursor:
+                yield path, self._row(labels)
+            return
+        rows = list(rows)
+        for i in range(0, len(rows), MAX_PARAMS):
+            chunk = rows[i:i + MAX_PARAMS]
+            marks = ','.join('?' * len(chunk))
+            for path, labels in conn.execute(f"SELECT path, labels FROM videos WHERE id IN ({marks}) ORDER BY id", chunk):
+                yield path, self._row(labels)
+
+    def view(self):
+        return SQLiteLabelsView(self)
+
+    def _labels_sql(self, category, wanted, params):
+        cid = CATEGORY_IDS[category]
+        ids = [self.label_ids[w] for w in wanted if w in self.label_ids]
+        counts = self.label_counts[cid]
+        if 'none' in wanted and counts.keys() <= set(ids):
+            return '1'  # every video passes, skip the per-video lookups
+        parts = []
+        if ids and 'none' not in wanted and sum(counts.get(i, 0) for i in ids) <= self.DRIVE_FRACTION * self.n:
+            # as a set of ids SQLite drives the query from the label index, which pays off for rare labels
+            # only (without sqlite_stat4 it can't tell a rare label from a common one)
+            params.extend(ids)
+            return (f"v.id IN (SELECT x.video_id FROM video_labels x WHERE x.category = {cid}"
+                    f" AND x.label_id IN ({','.join('?' * len(ids))}))")
+        if ids:
+            params.extend(ids)
+            parts.append(f"EXISTS (SELECT 1 FROM video_labels x WHERE x.video_id = v.id AND x.category = {cid}"
+                         f" AND x.label_id IN ({','.join('?' * len(ids))}))")
+        # 'none' selects videos without any label in this category
+        if 'none' in wanted:
+            parts.append(f"NOT EXISTS (SELECT 1 FROM video_labels x WHERE x.video_id = v.id AND x.category = {cid})")
+        return '(' + ' OR '.join(parts) + ')' if parts else '0'
+
+    def _query_sql(self, node, params):
+        """SQL condition for a query_dsl expression tree."""
+        op = node[0]
+        if op == 'term':
+            _, field, value = node
+            if field is None:
+                return '(' + ' OR '.join(self._labels_sql(c, (value,), params) for c in CATEGORIES) + ')'
+            if field == 'restricted':
+                return 'v.restricted = 1' if value == 'true' else 'v.restricted = 0'
+            if field == 'sites':
+                if value not in self.site_ids:
+                    return '0'
+                params.append(self.site_ids[value])
+                return 'v.site_id = ?'
+            return self._labels_sql(field, (value,), params)
+        if op == 'not':
+            return 'NOT ' + self._query_sql(node[1], params)
+        return '(' + f' {op.upper()} '.join(self._query_sql(n, params) for n in node[1:]) + ')'
+
+    def _where(self, sites, animals, actions, add_labels, restricted, start, end, query):
+        params = [start, end]
+        conditions = ['v.time BETWEEN ? AND ?']
+        site_ids = [self.site_ids[s] for s in sites if s in self.site_ids]
+        params.extend(site_ids)
+        conditions.append(f"v.site_id IN ({','.join('?' * len(site_ids))})" if site_ids else '0')
+        if restricted:
+            conditions.append('v.restricted = 0')
+        for category, wanted in (('animals', animals), ('actions', actions), ('additional_labels', add_labels)):
+            conditions.append(self._labels_sql(category, wanted, params))
+        if query is not None:
+            conditions.append(self._query_sql(query, params))
+        return ' AND '.join(conditions), params
+
+    def match(self, sites, animals, actions, add_labels, restricted, start, end, query=None):
+        """Ids (in date order) of the videos passing the filters; start and end are epoch seconds."""
+        where, params = self._where(sites, animals, actions, add_labels, restricted, start, end, query)
+        cursor = self._conn().execute(f"SELECT v.id FROM videos v WHERE {where} ORDER BY v.id", params)
+        return array('I', (i for i, in cursor))
+
+    def facets(self, sites, animals, actions, add_labels, restricted, start, end, query=None):
+        """Per-value counts of the matching videos, in the shape of LabelIndex.facets (reverse_subset in SQL)."""
+        where, params = self._where(sites, animals, actions, add_labels, restricted, start, end, query)
+        # -1: per site, -2: all matches, -3: matches with any label in a category, else per category and label
+        # (CROSS JOIN keeps SQLite from scanning all of video_labels against the matches)
+        sql = f"""WITH m AS MATERIALIZED (SELECT v.id, v.site_id FROM videos v WHERE {where})
+            SELECT -1, site_id, COUNT(*) FROM m WHERE site_id IS NOT NULL GROUP BY site_id
+            UNION ALL
+            SELECT -2, NULL, COUNT(*) FROM m
+            UNION ALL
+            SELECT -3, x.category, COUNT(DISTINCT x.video_id) FROM m CROSS JOIN video_labels x ON x.video_id = m.id GROUP BY x.category
+            UNION ALL
+            SELECT x.category, x.label_id, COUNT(*) FROM m CROSS JOIN video_labels x ON x.video_id = m.id GROUP BY x.category, x.label_id"""
+        names = ('animals', 'actions', 'add_labels')
+        facets = {'sites': {}, 'animals': {}, 'actions': {}, 'add_labels': {}}
+        total, labelled = 0, [0] * len(names)
+        for category, value_id, count in self._conn().execute(sql, params):
+            if category == -1:
+                site = self.site_names[value_id]
+                if site:
+                    facets['sites'][site] = count
+            elif category == -2:
+                total = count
+            elif category == -3:
+                labelled[value_id] = count
+            else:
+                facets[names[category]][self.label_names[value_id]] = count
+        # unlabelled videos and an explicit 'none' label both count as 'none'
+        for cid, name in enumerate(names):
+            none = total - labelled[cid] + facets[name].pop('none', 0)
+            if none:
+                facets[name]['none'] = none
+        return facets
+
+    def explain(self, sites, animals, actions, add_labels, restricted, start, end, query=None):
+        """SQLite's query plan for match(), one line per step."""
+        where, params = self._where(sites, animals, actions, add_labels, restricted, start, end, query)
+        cursor = self._conn().execute(f"EXPLAIN QUERY PLAN SELECT v.id FROM videos v WHERE {where} ORDER BY v.id", params)
+        return [detail for _, _, _, detail in cursor]
+
+    def keys_of(self, rows):
+        return [path for path, _ in self.items(rows)]
+
+class SQLiteLabelsView(Mapping):
+    """Read-only dict-like view of the videos table: path -> label dict."""
+
+    def __init__(self, labels):
+        self.labels = labels
+
+    def __getitem__(self, path):
+        found = self.labels._conn().execute("SELECT labels FROM videos WHERE path = ?", (path,)).fetchone()
+        if found is None:
+            raise KeyError(path)
+        return self.labels._row(found[0])
+
+    def __contains__(self, path):
+        return self.labels._conn().execute("SELECT 1 FROM videos WHERE path = ?", (path,)).fetchone() is not None
+
+    def __iter__(self):
+        return (path for path, in self.labels._conn().execute("SELECT path FROM videos ORDER BY id"))
+
+    def __len__(self):
+        return len(self.labels)
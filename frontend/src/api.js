@@ -5,6 +5,11 @@ export function fetchLabels(params, token) {
   const q = new URLSearchParams(params || {});
   const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
   return fetch(`${API}/api/labels${q.toString() ? `?${q}` : ''}`, { headers }).then(r => {
+    if (r.status === 503) {
+      // the server is still loading its data, ask again when it says to
+      const seconds = Number(r.headers.get('Retry-After')) || 5;
+      return new Promise(resolve => setTimeout(resolve, seconds * 1000)).then(() => fetchLabels(params, token));
+    }
     if (!r.ok) {
       if (r.status === 401) {
         localStorage.removeItem('token');
@@ -13,7 +18,33 @@ export function fetchLabels(params, token) {
       throw new Error('Failed to fetch');
     }
     return r.json();
+  }).then(expandCompactPayload);
+}
+
+// time_format codes of a compact row (label_store.py): datetime, date only, verbatim in extras
+const TIME_ISO = 0, TIME_DATE = 1;
+
+// Expand a format=compact response back into the usual { path: labels } map
+export function expandCompactPayload(d) {
+  const c = d && d.video_labels;
+  if (!c || c.format !== 'compact-v2') return d;
+  const labels = ids => ids.map(j => c.labels[j]);
+  const videoLabels = {};
+  c.rows.forEach(([prefix, name, site, time, timeFormat, animals, actions, addLabels, restricted], n) => {
+    // same fields, in the same order, as the full format; null means the video doesn't have it
+    const lbl = {};
+    if (site !== null) lbl.site = c.sites[site];
+    if (animals !== null) lbl.animals = labels(animals);
+    if (actions !== null) lbl.actions = labels(actions);
+    if (addLabels !== null) lbl.additional_labels = labels(addLabels);
+    if (timeFormat === TIME_ISO) lbl.time = new Date(time * 1000).toISOString().slice(0, 19);
+    else if (timeFormat === TIME_DATE) lbl.time = new Date(time * 1000).toISOString().slice(0, 10);
+    if (restricted !== null) lbl.restricted = restricted === 1;
+    Object.assign(lbl, c.extras[n] || {});
+    if (site !== null && c.elevations[site] !== null) lbl.elevation = c.elevations[site];
+    videoLabels[c.prefixes[prefix] + name] = lbl;
   });
+  return { ...d, video_labels: videoLabels };
 }
 
 export function buildVideoUrl(path) {